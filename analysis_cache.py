@@ -0,0 +1,59 @@
+import numpy as np
+import hashlib
+import os
+
+
+# Cache su disco delle analisi dei brani.
+# Per ogni brano salva le feature (energie delle bande) di tutti i chunk in un file .npy,
+# identificato da path, dimensione e data di modifica del file e dai parametri di analisi.
+# I file vengono riaperti in memory-map, senza caricarli in memoria.
+# Quando la dimensione totale supera il limite vengono eliminati i file usati meno di recente.
+class AnalysisCache():
+    # folder: cartella dei file di cache, max_bytes: dimensione massima totale della cache
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    # path del file di cache del brano, params: dict dei parametri di analisi
+    def _file(self, path, params):
+        st = os.stat(path)
+        key = repr((os.path.abspath(path), st.st_size, st.st_mtime_ns, sorted(params.items())))
+        return os.path.join(self.folder, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    # ritorna l'array (chunk x bande) in memory-map delle feature del brano o None se non presente
+    def load(self, path, params):
+        try:
+            file = self._file(path, params)
+            features = np.load(file, mmap_mode='r')
+            # aggiornamento della data di ultimo utilizzo per la politica LRU
+            os.utime(file)
+            return features
+        except (OSError, ValueError):
+            return None
+
+    # salva le feature del brano e libera spazio se la cache supera la dimensione massima
+    def store(self, path, params, features):
+        try:
+            file = self._file(path, params)
+            # scrittura su un file temporaneo e rinomina, un file a metà non viene mai letto
+            with open(file + '.tmp', 'wb') as f:
+                np.save(f, features)
+            os.replace(file + '.tmp', file)
+            self._evict()
+        except OSError as ex:
+            print('Errore ' + str(ex) + ' nel salvataggio della cache')
+
+    # elimina i file usati meno di recente finché la cache non rientra nella dimensione massima
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.npy'):
+                st = os.stat(os.path.join(self.folder, name))
+                entries.append((st.st_mtime, st.st_size, os.path.join(self.folder, name)))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, file) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(file)
+            total -= size
@@ -0,0 +1,52 @@
+from dmx_encoder import DMXEncoder
+import numpy as np
+import struct
+
+# porta udp standard dei nodi Art-Net
+ARTNET_PORT = 6454
+# identificativo, opcode ArtDMX (little endian) e versione del protocollo (14)
+ARTNET_ID = b'Art-Net\x00'
+OP_DMX = 0x5000
+PROTOCOL_VERSION = 14
+
+
+# Classe che codifica i pacchetti ArtDMX binari per i nodi Art-Net.
+# Il pacchetto (intestazione di 18 byte e canali dell'universo fino all'ultima lampada)
+# è preallocato: ad ogni frame vengono scritti solo il numero di sequenza e i canali delle lampade.
+class ArtNetEncoder(DMXEncoder):
+    # first_chan: primo canale (0-511) nell'universo, mins e maxs: luce minima e massima di ogni lampada,
+    # universe: indirizzo di porta a 15 bit (net, subnet e universo)
+    def __init__(self, first_chan, mins, maxs, universe=0):
+        super(ArtNetEncoder, self).__init__(first_chan, mins, maxs)
+        # numero di canali inviati: fino all'ultima lampada, pari come richiesto dal protocollo
+        slots = first_chan + self.lights * 3
+        slots += slots % 2
+        # intestazione: id, opcode, versione, sequenza, porta fisica, universo (SubUni e Net), lunghezza
+        self.header = ARTNET_ID + struct.pack('<H', OP_DMX) + struct.pack(
+            '>HBBBBH', PROTOCOL_VERSION, 0, 0, universe & 0xff, (universe >> 8) & 0x7f, slots
+        )
+        self.frame = bytearray(self.header + bytes(slots))
+        # canali delle lampade nel pacchetto (lampade x 3)
+        self._channels = np.frombuffer(
+            self.frame, dtype=np.uint8, offset=len(self.header) + first_chan, count=self.lights * 3
+        ).reshape(-1, 3)
+        # numero di sequenza, da 1 a 255 (0 disabilita il riordino nel nodo)
+        self.sequence = 0
+
+    # avanza il numero di sequenza del pacchetto
+    def _next_sequence(self):
+        self.sequence = self.sequence % 255 + 1
+        self.frame[12] = self.sequence
+
+    # scrive nel pacchetto i valori normalizzati delle lampade e il nuovo numero di sequenza
+    def _write(self):
+        self._channels[:] = self.values
+        self._next_sequence()
+        return self.frame
+
+    # ritorna il pacchetto che spegne tutte le luci
+    def off(self):
+        self.values[:] = 0
+        self._channels[:] = 0
+        self._next_sequence()
+        return self.frame
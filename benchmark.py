@@ -0,0 +1,545 @@
+from socket import socket, AF_INET, SOCK_DGRAM
+from ring_buffer import SharedRingBuffer, capacity_for, CHUNK
+from main_light_controller import LIVE_MAXLEN, FRAME_BYTES
+import config
+import line_in
+from spectral_features import FeatureExtractor, FEATURES
+from onset import OnsetDetector
+import music_reader
+import music_player
+import udp_sender
+import show
+import numpy as np
+import threading
+import argparse
+import tempfile
+import shutil
+import queue
+import wave
+import time
+import os
+
+'''
+Benchmark dell'intera catena reader -> player -> sender senza hardware:
+- genera brani wav sintetici (toni, rumore, battiti) a varie frequenze e numero di canali
+- sostituisce l'output di pyaudio con un'uscita nulla che consuma l'audio in tempo reale
+- riceve i frame EDMX su un socket UDP locale al posto del gateway
+Uso: python benchmark.py [--duration 3] [--rates 44100 48000] [--channels 1 2] [--kinds tone noise beats]
+Con --live misura invece la latenza cattura -> luce della modalità live, usando come
+ingresso un brano sintetico letto al ritmo della cattura: python benchmark.py --live [--hop 256]
+Con --onset misura il costo per chunk del rilevatore di battiti rispetto alla sola fft
+e i battiti e il tempo rilevati sui brani sintetici: python benchmark.py --onset
+Con --show renderizza prima i brani e misura la catena in modalità show (sender senza analisi)
+Con --fft N i brani sono analizzati con finestre di N campioni (tag Analysis)
+Con --buffer S il reader legge in anticipo S secondi di audio (tag Buffer)
+'''
+
+
+# genera i campioni (frame x canali) int16 di un brano sintetico
+def synth(kind, rate, channels, duration, seed=0):
+    t = np.arange(int(rate * duration)) / rate
+    if kind == 'tone':
+        # sweep di un tono da 50 Hz a 5 kHz
+        freq = 50 * (100 ** (t / duration))
+        wave_data = np.sin(2 * np.pi * np.cumsum(freq) / rate)
+    elif kind == 'noise':
+        wave_data = np.random.default_rng(seed).uniform(-1, 1, len(t))
+    elif kind == 'beats':
+        # cassa a 120 bpm: burst a 60 Hz con decadimento esponenziale ogni mezzo secondo
+        phase = t % 0.5
+        wave_data = np.sin(2 * np.pi * 60 * phase) * np.exp(-phase * 20)
+    else:
+        raise ValueError('Tipo di brano "' + kind + '" non valido')
+    samples = (wave_data * 20000).astype(np.int16)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+
+# scrive un brano sintetico in formato wav e ritorna la sua durata in secondi
+def write_track(path, kind, rate, channels, duration):
+    wf = wave.open(path, 'wb')
+    wf.setnchannels(channels)
+    wf.setsampwidth(2)
+    wf.setframerate(rate)
+    wf.writeframes(synth(kind, rate, channels, duration).tobytes())
+    wf.close()
+    return duration
+
+
+# Stream di output nullo: consuma l'audio alla velocità reale del brano.
+# Ha un buffer di buffer_frames frame e una latenza fissa verso il "dac": write() si blocca
+# finché non c'è spazio nel buffer come uno stream pyaudio. Registra l'istante in cui
+# ogni chunk scritto diventa udibile e le volte in cui il buffer si è svuotato.
+# Con stream_callback un thread chiede i frames_per_buffer frame alla callback un buffer
+# prima che siano udibili, passando l'istante di riproduzione come pyaudio.
+class NullStream():
+    def __init__(self, sink, format, channels, rate, output=True, frames_per_buffer=1024,
+                 stream_callback=None, buffer_frames=2048, latency=0.010):
+        self.sink = sink
+        self.frame_bytes = channels * music_player.pyaudio.get_sample_size(format)
+        self.rate = rate
+        self.buffer = buffer_frames / rate
+        self.latency = latency
+        # istante in cui termina l'audio già presente nel buffer
+        self.queued_until = time.monotonic()
+        # True dopo la prima scrittura, prima non ci sono buchi nell'audio
+        self.started = False
+        self.frames = frames_per_buffer
+        self.callback = stream_callback
+        self.active = stream_callback is not None
+        if self.active:
+            self.thread = threading.Thread(target=self._pull, daemon=True)
+            self.thread.start()
+
+    def get_time(self):
+        return time.monotonic()
+
+    def get_output_latency(self):
+        return self.latency
+
+    # chiamate della callback al ritmo del brano
+    def _pull(self):
+        duration = self.frames / self.rate
+        # istante in cui inizia la riproduzione del prossimo buffer
+        play = time.monotonic() + self.buffer
+        while self.active:
+            start = time.monotonic()
+            (data, flag) = self.callback(None, self.frames, {
+                'current_time': start, 'output_buffer_dac_time': play + self.latency
+            }, 0)
+            self.sink.write_block += time.monotonic() - start
+            if len(data) != self.frames * self.frame_bytes:
+                raise ValueError('buffer della callback di lunghezza errata')
+            if flag != music_player.pyaudio.paContinue:
+                break
+            play += duration
+            wait = play - self.buffer - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        self.queued_until = play
+
+    def write(self, raw):
+        start = time.monotonic()
+        duration = len(raw) / self.frame_bytes / self.rate
+        if self.queued_until < start:
+            # il buffer si è svuotato: buco nell'audio
+            if self.started:
+                self.sink.underruns += 1
+            self.queued_until = start
+        self.started = True
+        # attesa che nel buffer ci sia spazio per il chunk
+        wait = self.queued_until + duration - self.buffer - start
+        if wait > 0:
+            time.sleep(wait)
+        self.sink.audible.append(self.queued_until + self.latency)
+        self.sink.write_block += time.monotonic() - start
+        self.queued_until += duration
+
+    def is_active(self):
+        return self.active
+
+    # ferma lo stream dopo la riproduzione dell'audio già nel buffer
+    def stop_stream(self):
+        if self.active:
+            self.active = False
+            self.thread.join()
+        wait = self.queued_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def close(self):
+        self.active = False
+
+
+# sostituto di pyaudio.PyAudio che apre stream nulli e ne raccoglie le misure
+class NullSink():
+    def __init__(self):
+        # istanti in cui ogni chunk è diventato udibile, nell'ordine di scrittura
+        self.audible = []
+        # numero di volte in cui il buffer si è svuotato e tempo passato bloccato in write()
+        # o nelle callback
+        self.underruns = 0
+        self.write_block = 0.0
+
+    def __call__(self):
+        return self
+
+    def open(self, format, channels, rate, output=True, frames_per_buffer=1024, stream_callback=None):
+        return NullStream(self, format, channels, rate, output, frames_per_buffer, stream_callback)
+
+    def terminate(self):
+        pass
+
+
+# Gateway finto: riceve e decodifica i frame EDMX su un socket UDP locale
+class CaptureGateway(threading.Thread):
+    def __init__(self):
+        super(CaptureGateway, self).__init__(daemon=True)
+        self.socket = socket(AF_INET, SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(0.2)
+        self.port = self.socket.getsockname()[1]
+        # tuple (istante di arrivo, valori dei canali) dei frame ricevuti
+        self.frames = []
+        # frame non conformi al formato EDMX
+        self.malformed = 0
+        self.running = True
+
+    # decodifica un frame EDMX, Art-Net o sACN. Ritorna il primo canale e i valori dei canali
+    @staticmethod
+    def decode(data):
+        if data[:4] == b'EDMX':
+            # intestazione, primo canale, numero di canali e valori esadecimali
+            count = int(data[7:10])
+            values = bytes.fromhex(data[10:].decode())
+            if len(values) != count:
+                raise ValueError('Numero di canali non valido')
+            return (int(data[4:7]), values)
+        if data[:8] == b'Art-Net\x00':
+            # opcode ArtDMX, lunghezza pari e canali dell'universo dal primo
+            if data[8:10] != b'\x00\x50' or int.from_bytes(data[16:18], 'big') != len(data) - 18 or len(data) % 2:
+                raise ValueError('Pacchetto ArtDMX non valido')
+            return (0, data[18:])
+        if data[4:16] == b'ASC-E1.17\x00\x00\x00':
+            # lunghezze dei tre livelli, numero di valori e start code nullo
+            lengths = [int.from_bytes(data[i:i + 2], 'big') & 0x0fff for i in (16, 38, 115)]
+            if lengths != [len(data) - 16, len(data) - 38, len(data) - 115] or data[125] != 0 \
+                    or int.from_bytes(data[123:125], 'big') != len(data) - 125:
+                raise ValueError('Pacchetto sACN non valido')
+            return (0, data[126:])
+        raise ValueError('Intestazione non valida')
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.socket.recv(65535)
+            except OSError:
+                continue
+            now = time.monotonic()
+            try:
+                self.frames.append((now, self.decode(data)[1]))
+            except ValueError:
+                self.malformed += 1
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.socket.close()
+
+
+# scrive il file di configurazione del benchmark nella cartella passata
+# extra: tag aggiuntivi da inserire nella configurazione, lights: numero di lampade,
+# divise in universi (gateway) da 170 lampade con effetti di inseguimento
+# protocol: protocollo dei gateway (edmx, artnet, sacn)
+def write_config(folder, port, extra='', lights=10, protocol='edmx'):
+    gateways = ''
+    for first in range(0, lights, 170):
+        gateways += (
+            '    <Gateway name="capture{0}" address="127.0.0.1" port="{1}" firstChannel="000" keepalive="0"'
+            ' protocol="{2}" universe="{3}">\n'
+        ).format(first // 170, port, protocol, 0 if protocol == 'edmx' else first // 170 + (protocol == 'sacn'))
+        gateways += ''.join(
+            '      <Light name="l{0}" type="RGB" minlum="0" maxlum="1" position="{1}" phase="{2}" decay="0.6"/>\n'.format(
+                i, i - first, i % 8) for i in range(first, min(first + 170, lights))
+        )
+        gateways += '    </Gateway>\n'
+    with open(os.path.join(folder, 'config.xml'), 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Configuration for="gestioneLuci">\n'
+            '  <Paths>\n'
+            '    <MusicFolder name="benchmark" type="wav" path="."/>\n'
+            '  </Paths>\n'
+            '  <AudioRange>\n'
+            '    <Scale value="0.00060"/>\n'
+            '    <SubValue value="20"/>\n'
+            '    <MinThreshold value="0"/>\n'
+            '    <Red low="0" high="258"/>\n'
+            '    <Green low="258" high="1076"/>\n'
+            '    <Blue low="1076" high="22050"/>\n'
+            '  </AudioRange>\n'
+            '  <Devices>\n'
+            + gateways +
+            '  </Devices>\n'
+            + extra +
+            '</Configuration>\n'
+        )
+
+
+# esegue il metodo run() del processo passato misurando il tempo di cpu del thread
+def timed_run(stage, cpu):
+    start = time.thread_time()
+    try:
+        stage.run()
+    finally:
+        cpu[type(stage).__name__] = time.thread_time() - start
+
+
+# esegue la catena completa sui brani sintetici e ritorna il dict dei risultati
+def run_benchmark(duration, rates, channels, kinds, late_after=0.005, lights=10, protocol='edmx', output='blocking',
+                  rendered=False, refresh=0.0, fft=1024, buffer=2.0):
+    folder = tempfile.mkdtemp(prefix='scl_benchmark_')
+    audio_seconds = 0.0
+    for kind in kinds:
+        for rate in rates:
+            for ch in channels:
+                name = '{0}_{1}_{2}ch.wav'.format(kind, rate, ch)
+                audio_seconds += write_track(os.path.join(folder, name), kind, rate, ch, duration)
+    gateway = CaptureGateway()
+    gateway.start()
+    extra = '<Output mode="' + output + '"/>\n<Analysis fft="{0}"/>\n'.format(fft)
+    extra += '<Buffer seconds="{0}" max="{1}"/>\n'.format(buffer, max(buffer, 8.0))
+    if refresh > 0:
+        extra += '<Refresh rate="{0}" attack="0.02" release="0.15"/>\n'.format(refresh)
+    write_config(folder, gateway.port, extra, lights=lights, protocol=protocol)
+    cfg = config.load(os.path.join(folder, 'config.xml'))
+    # in modalità show i brani vengono renderizzati prima della misura
+    timeline = None
+    render_seconds = 0.0
+    if rendered:
+        start = time.monotonic()
+        show.render(cfg)
+        render_seconds = time.monotonic() - start
+        timeline = show.read_index(cfg)
+    # sostituzione dell'output audio
+    sink = NullSink()
+    real_pyaudio = music_player.pyaudio.PyAudio
+    music_player.pyaudio.PyAudio = sink
+    slot_bytes = cfg.analysis.hop * FRAME_BYTES
+    sound_data = SharedRingBuffer(capacity_for(cfg.buffer.budget, slot_bytes, len(FEATURES)), slot_bytes, len(FEATURES), shared=False)
+    if output == 'callback':
+        # con la callback i chunk non corrispondono ai buffer dello stream: l'istante in cui
+        # ogni chunk è udibile è quello scritto dal player, ricavato dai tempi del NullStream
+        stamp = sound_data.stamp
+
+        def recorded(name, value):
+            sink.audible.append(value)
+            stamp(name, value)
+        sound_data.stamp = recorded
+    meta_data = queue.Queue()
+    cpu = {}
+    try:
+        stages = (
+            music_reader.MusicReader(sound_data, meta_data, cfg, timeline),
+            music_player.MusicPlayer(sound_data, meta_data, cfg),
+            udp_sender.UdpSender(sound_data, meta_data, cfg, show.ShowBuilder(cfg) if rendered else None)
+        )
+        threads = [threading.Thread(target=timed_run, args=(stage, cpu)) for stage in stages]
+        start = time.monotonic()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        wall = time.monotonic() - start
+        time.sleep(0.1)
+    finally:
+        music_player.pyaudio.PyAudio = real_pyaudio
+        gateway.stop()
+        sound_data.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # gli ultimi frame sono lo spegnimento delle luci a fine playlist, uno per gateway.
+    # Con più gateway si misura il primo universo
+    universes = len(cfg.gateways)
+    frames = gateway.frames[:-universes][::universes]
+    # a frequenza fissa i frame non corrispondono ai chunk: la latenza non è misurabile
+    pairs = min(len(frames), len(sink.audible)) if refresh <= 0 else 0
+    latency = np.array([frames[i][0] - sink.audible[i] for i in range(pairs)])
+    return {
+        'tracks': len(kinds) * len(rates) * len(channels),
+        'audio_seconds': audio_seconds,
+        'wall_seconds': wall,
+        'render_seconds': render_seconds,
+        'chunks': len(sink.audible),
+        'cpu': cpu,
+        'frames_received': len(frames),
+        'frames_dropped': max(0, len(sink.audible) - len(frames)) if refresh <= 0 else 0,
+        # intervalli tra due frame ricevuti
+        'intervals': np.diff([t for (t, _) in frames]),
+        'frames_late': int(np.sum(latency > late_after)),
+        'frames_malformed': gateway.malformed,
+        'latency': latency,
+        # con la callback i buchi sono contati dal player, che riempie di silenzio
+        'underruns': sink.underruns if output == 'blocking' else stages[1].stats.counters.get('underruns', 0),
+        'write_block': sink.write_block,
+        'telemetry': [stage.stats.snapshot() for stage in stages],
+    }
+
+
+# Sorgente che registra l'istante in cui ogni blocco di frame viene restituito (catturato)
+class TimedSource():
+    def __init__(self, source, captured):
+        self.source = source
+        self.captured = captured
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def readframes(self, n):
+        raw = self.source.readframes(n)
+        if len(raw) > 0:
+            self.captured.append(time.monotonic())
+        return raw
+
+
+# esegue la modalità live con un brano sintetico come ingresso e ritorna il dict dei risultati
+def run_live_benchmark(duration, hop, rate=44100, channels=2, kind='beats'):
+    folder = tempfile.mkdtemp(prefix='scl_benchmark_')
+    write_track(os.path.join(folder, 'live.wav'), kind, rate, channels, duration)
+    gateway = CaptureGateway()
+    gateway.start()
+    write_config(folder, gateway.port, (
+        '  <Capture source="stream" path="live.wav" realtime="1" rate="{0}" channels="{1}" hop="{2}"/>\n'
+    ).format(rate, channels, hop))
+    cfg = config.load(os.path.join(folder, 'config.xml'))
+    # registrazione degli istanti di cattura
+    captured = []
+    real_open = line_in.open_source
+    line_in.open_source = lambda capture: TimedSource(real_open(capture), captured)
+    sound_data = SharedRingBuffer(LIVE_MAXLEN, FRAME_BYTES, len(FEATURES), (('sender', None),), shared=False, latest=True)
+    # istanti di cattura delle analisi lette dal sender, che salta quelle rimaste indietro
+    sent = []
+    real_get = sound_data.get
+
+    def get(name, timeout=None):
+        slot = real_get(name, timeout)
+        if slot is not None and slot.kind == CHUNK:
+            sent.append(slot.stamp)
+        return slot
+    sound_data.get = get
+    cpu = {}
+    try:
+        stages = (line_in.LineIn(sound_data, cfg), udp_sender.UdpSender(sound_data, queue.Queue(), cfg))
+        threads = [threading.Thread(target=timed_run, args=(stage, cpu)) for stage in stages]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        time.sleep(0.1)
+    finally:
+        line_in.open_source = real_open
+        gateway.stop()
+        sound_data.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # l'ultimo frame è lo spegnimento delle luci a fine cattura
+    frames = gateway.frames[:-1]
+    # ogni analisi letta dal sender produce un frame
+    pairs = min(len(frames), len(sent))
+    latency = np.array([frames[i][0] - sent[i] for i in range(pairs)])
+    return {
+        'hop': hop,
+        'rate': rate,
+        'hops': len(captured),
+        'cpu': cpu,
+        'frames_received': len(frames),
+        'dropped': len(captured) - len(sent),
+        'latency': latency
+    }
+
+
+# stampa i risultati del benchmark live
+def report_live(res):
+    hop_ms = res['hop'] * 1000 / res['rate']
+    print('Hop: {0} frame ({1:.2f} ms), hop catturati: {2}, frame ricevuti: {3}, analisi scartate: {4}'.format(
+        res['hop'], hop_ms, res['hops'], res['frames_received'], res['dropped']))
+    for (name, cpu) in res['cpu'].items():
+        print('  {0:<12} {1:8.3f} s di cpu  {2:8.3f} ms/hop'.format(name, cpu, cpu * 1000 / max(res['hops'], 1)))
+    lat = res['latency'] * 1000
+    if len(lat) > 0:
+        print('Latenza fine hop -> luce [ms]: media {0:.2f}, p50 {1:.2f}, p95 {2:.2f}, p99 {3:.2f}, max {4:.2f}'.format(
+            np.mean(lat), np.percentile(lat, 50), np.percentile(lat, 95), np.percentile(lat, 99), np.max(lat)))
+        # il primo campione di un hop è stato catturato un hop prima della fine del blocco
+        print('Latenza cattura -> luce nel caso peggiore (p99 + hop) [ms]: {0:.2f}'.format(np.percentile(lat, 99) + hop_ms))
+
+
+# analizza i brani sintetici con e senza rilevatore di battiti, a blocchi di batch chunk
+# come il reader, e ritorna il dict dei risultati per tipo di brano
+def run_onset_benchmark(duration, kinds, rate=44100, chunk=1024, batch=8, bpm=120):
+    extractor = FeatureExtractor([(0, 258), (258, 1076), (1076, 22050)], 0)
+    results = {}
+    for kind in kinds:
+        samples = synth(kind, rate, 1, duration)[:, 0]
+        chunks = [samples[i:i + chunk] for i in range(0, len(samples) - chunk + 1, chunk)]
+        start = time.perf_counter()
+        for i in range(0, len(chunks), batch):
+            extractor.extract_many(chunks[i:i + batch], rate)
+        fft = time.perf_counter() - start
+        onset = OnsetDetector(chunk / rate)
+        start = time.perf_counter()
+        features = np.vstack([extractor.extract_many(chunks[i:i + batch], rate, onset) for i in range(0, len(chunks), batch)])
+        total = time.perf_counter() - start
+        beats = features[:, FEATURES.index('beat')] > 0
+        results[kind] = {
+            'chunks': len(chunks),
+            'fft_us': fft * 1e6 / len(chunks),
+            'onset_us': (total - fft) * 1e6 / len(chunks),
+            'beats': int(np.sum(beats)),
+            # battiti attesi nei brani 'beats' (cassa a bpm battiti al minuto)
+            'expected': int(duration * bpm / 60) if kind == 'beats' else None,
+            'tempo': features[-1, FEATURES.index('tempo')]
+        }
+    return results
+
+
+# stampa i risultati del benchmark dei battiti
+def report_onset(res):
+    for (kind, r) in res.items():
+        print('{0:<6} chunk {1}: fft {2:.1f} us/chunk, rilevatore {3:.1f} us/chunk, battiti {4}{5}, tempo {6:.1f} bpm'.format(
+            kind, r['chunks'], r['fft_us'], r['onset_us'], r['beats'],
+            ' (attesi {0})'.format(r['expected']) if r['expected'] is not None else '', r['tempo']))
+
+
+# stampa i risultati del benchmark
+def report(res):
+    print('Brani: {0}, audio: {1:.1f} s, tempo reale: {2:.1f} s, chunk: {3}'.format(
+        res['tracks'], res['audio_seconds'], res['wall_seconds'], res['chunks']))
+    if res['render_seconds'] > 0:
+        print('Rendering dello show: {0:.2f} s'.format(res['render_seconds']))
+    print('Tempo di cpu per processo:')
+    for (name, cpu) in res['cpu'].items():
+        rtf = res['audio_seconds'] / cpu if cpu > 0 else float('inf')
+        print('  {0:<12} {1:8.3f} s  {2:8.3f} ms/chunk  {3:8.1f}x tempo reale'.format(
+            name, cpu, cpu * 1000 / max(res['chunks'], 1), rtf))
+    print('Frame: ricevuti {0}, persi {1}, in ritardo {2}, non validi {3}'.format(
+        res['frames_received'], res['frames_dropped'], res['frames_late'], res['frames_malformed']))
+    lat = res['latency'] * 1000
+    if len(lat) > 0:
+        print('Latenza audio -> luce [ms]: media {0:.2f}, p50 {1:.2f}, p95 {2:.2f}, max {3:.2f}, jitter {4:.2f}'.format(
+            np.mean(lat), np.percentile(lat, 50), np.percentile(lat, 95), np.max(lat), np.std(lat)))
+    gaps = res['intervals'] * 1000
+    if len(gaps) > 0:
+        print('Intervallo tra frame [ms]: media {0:.2f}, p95 {1:.2f}, max {2:.2f}, jitter {3:.2f}'.format(
+            np.mean(gaps), np.percentile(gaps, 95), np.max(gaps), np.std(gaps)))
+    print('Audio: buffer svuotato {0} volte, {1:.1f} s in write() o nelle callback'.format(res['underruns'], res['write_block']))
+    print('Telemetria:')
+    for snap in res['telemetry']:
+        print('  ' + snap['stage'] + ' ' + ', '.join('{0}={1}'.format(k, v) for (k, v) in snap['counters'].items()))
+        for (name, h) in snap['histograms'].items():
+            print('    {0:<10} p50 {1} us, p95 {2} us, max {3} us'.format(name, h['p50_us'], h['p95_us'], h['max_us']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark della catena reader -> player -> sender')
+    parser.add_argument('--duration', type=float, default=3.0, help='durata in secondi di ogni brano')
+    parser.add_argument('--rates', type=int, nargs='+', default=[44100, 48000])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--kinds', nargs='+', default=['tone', 'noise', 'beats'])
+    parser.add_argument('--lights', type=int, default=10, help='numero di lampade, 170 per universo')
+    parser.add_argument('--protocol', default='edmx', choices=['edmx', 'artnet', 'sacn'])
+    parser.add_argument('--output', default='blocking', choices=['blocking', 'callback'], help='uscita audio del player')
+    parser.add_argument('--refresh', type=float, default=0.0, help='aggiornamenti al secondo (0 = uno per chunk)')
+    parser.add_argument('--fft', type=int, default=1024, help='campioni della finestra di analisi dei brani')
+    parser.add_argument('--buffer', type=float, default=2.0, help='secondi di audio letti in anticipo dal reader')
+    parser.add_argument('--show', action='store_true', help='renderizza i brani e misura la modalità show')
+    parser.add_argument('--live', action='store_true', help='misura la latenza della modalità live')
+    parser.add_argument('--hop', type=int, default=256, help='frame tra due analisi in modalità live')
+    parser.add_argument('--onset', action='store_true', help='misura il costo del rilevatore di battiti')
+    args = parser.parse_args()
+    if args.onset:
+        report_onset(run_onset_benchmark(args.duration, args.kinds))
+    elif args.live:
+        report_live(run_live_benchmark(args.duration, args.hop))
+    else:
+        report(run_benchmark(args.duration, args.rates, args.channels, args.kinds, lights=args.lights,
+                             protocol=args.protocol, output=args.output, rendered=args.show,
+                             refresh=args.refresh, fft=args.fft, buffer=args.buffer))
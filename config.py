@@ -0,0 +1,569 @@
+from xml.dom import minidom as md
+from dataclasses import dataclass, replace
+from xml.parsers.expat import ExpatError
+from typing import Optional, Tuple
+from spectral_features import BANDS, TAPERS, REFERENCE_SIZE
+import os
+import re
+
+'''
+NB: - config.xml viene letto una sola volta dal main con load(), l'oggetto Config è immutabile
+      e viene passato a reader, player e sender
+    - gli errori di configurazione sollevano ConfigError, gestita dal main
+    - AudioRange, luce minima/massima ed effetti delle lampade possono essere modificati durante
+      l'esecuzione: ConfigWatcher rilegge il file quando cambia e ritorna la nuova configurazione
+'''
+
+# valore di default degli attributi obbligatori
+REQUIRED = object()
+# frequenza di campionamento a cui sono riferiti gli indici start/finish delle bande, formato
+# precedente alle bande in Hz: indici della fft completa di REFERENCE_SIZE campioni
+LEGACY_RATE = 44100
+
+# Schema del file di configurazione.
+# tag: (tag obbligatorio, {attributo: (conversione, valore di default o REQUIRED)})
+SCHEMA = {
+    'MusicFolder': (True, {'name': (str, REQUIRED), 'type': (str, REQUIRED), 'path': (str, REQUIRED)}),
+    'Decoder': (False, {'mode': (str, 'stream'), 'rate': (int, 44100), 'channels': (int, 2)}),
+    'Library': (False, {'path': (str, 'library.json'), 'workers': (int, 0)}),
+    'AnalysisCache': (False, {'path': (str, REQUIRED), 'maxsize': (float, REQUIRED)}),
+    'Prefetch': (False, {'tracks': (int, 0), 'workers': (int, 1), 'budget': (float, 0.0)}),
+    'Buffer': (False, {'seconds': (float, 2.0), 'max': (float, 8.0), 'low': (float, 0.5), 'budget': (float, 8.0)}),
+    'Scale': (True, {'value': (float, REQUIRED)}),
+    'SubValue': (True, {'value': (float, REQUIRED)}),
+    'MinThreshold': (True, {'value': (int, REQUIRED)}),
+    'Red': (True, {'start': (int, None), 'finish': (int, None), 'low': (float, None), 'high': (float, None)}),
+    'Green': (True, {'start': (int, None), 'finish': (int, None), 'low': (float, None), 'high': (float, None)}),
+    'Blue': (True, {'start': (int, None), 'finish': (int, None), 'low': (float, None), 'high': (float, None)}),
+    'Analysis': (False, {'fft': (int, REFERENCE_SIZE), 'hop': (int, REFERENCE_SIZE), 'taper': (str, 'rect')}),
+    'Sync': (False, {'offset': (float, 0.0)}),
+    'Refresh': (False, {'rate': (float, 0.0), 'attack': (float, 0.0), 'release': (float, 0.0)}),
+    'Gateway': (True, {
+        'name': (str, REQUIRED),
+        'address': (str, REQUIRED),
+        'port': (int, None),
+        'firstChannel': (int, REQUIRED),
+        'protocol': (str, 'edmx'),
+        'universe': (int, None),
+        'maxfps': (float, 0.0),
+        'keepalive': (float, 1.0),
+        'threshold': (int, 0)
+    }),
+    'Light': (True, {
+        'name': (str, ''),
+        'type': (str, REQUIRED),
+        'minlum': (float, REQUIRED),
+        'maxlum': (float, REQUIRED),
+        'position': (int, REQUIRED),
+        'band': (str, 'all'),
+        'color': (str, 'rgb'),
+        'phase': (int, 0),
+        'decay': (float, 0.0)
+    }),
+    'Telemetry': (False, {'interval': (float, REQUIRED), 'address': (str, None), 'port': (int, None)}),
+    'Reload': (False, {'interval': (float, 1.0)}),
+    'Beat': (False, {
+        'sensitivity': (float, 2.5),
+        'minbpm': (float, 60.0),
+        'maxbpm': (float, 180.0),
+        'flash': (float, 0.0),
+        'rotate': (int, 0)
+    }),
+    'Show': (False, {'path': (str, 'show.scl'), 'workers': (int, 0)}),
+    'Output': (False, {'mode': (str, 'blocking'), 'frames': (int, 1024)}),
+    'Capture': (False, {
+        'source': (str, 'device'),
+        'path': (str, ''),
+        'device': (int, -1),
+        'rate': (int, 44100),
+        'channels': (int, 2),
+        'hop': (int, 256),
+        'window': (int, 1024),
+        'realtime': (int, 0)
+    })
+}
+
+# protocolli dei gateway: (porta di default, universo di default, universi validi)
+PROTOCOLS = {
+    'edmx': (None, 0, range(1)),
+    'artnet': (6454, 0, range(32768)),
+    'sacn': (5568, 1, range(1, 64000))
+}
+
+
+# Errore nel file di configurazione, il messaggio è già pronto per essere stampato
+class ConfigError(Exception):
+    pass
+
+
+# Cartella musicale: nome, tipo di file contenuti (il programma non ne tiene conto) e path assoluta
+@dataclass(frozen=True)
+class Folder():
+    name: str
+    type: str
+    path: str
+
+
+# Decodifica dei file mp3. stream: lettura dalla pipe di ffmpeg, convert: conversione in un file wav.
+# rate e channels: formato dell'audio decodificato in modalità stream
+@dataclass(frozen=True)
+class Decoder():
+    mode: str
+    rate: int
+    channels: int
+
+
+# Indice della libreria musicale (vedi library.py): file dell'indice e thread che leggono
+# i file nuovi o modificati (0 = uno per core)
+@dataclass(frozen=True)
+class Library():
+    path: str
+    workers: int = 0
+
+
+# Cache delle analisi: cartella e dimensione massima in byte
+@dataclass(frozen=True)
+class Cache():
+    path: str
+    max_bytes: int
+
+
+# Lettura anticipata: brani preparati in anticipo, thread che li preparano e byte massimi di audio letto
+@dataclass(frozen=True)
+class Prefetch():
+    tracks: int
+    workers: int
+    budget: int
+
+
+# Buffer circolare tra reader, player e sender: secondi di audio letti in anticipo all'avvio e
+# massimi raggiungibili dopo buchi nell'audio, livello basso (frazione di quello alto) sotto cui
+# il reader riprende a scrivere e byte massimi occupati dalle celle
+@dataclass(frozen=True)
+class Buffer():
+    seconds: float = 2.0
+    max_seconds: float = 8.0
+    low: float = 0.5
+    budget: int = 8 * 1024 * 1024
+
+
+# Parametri dell'analisi: fattore di scala, valore sottratto, soglia della fft
+# e tuple (frequenza minima, frequenza massima) in Hz per ogni banda, nell'ordine di BANDS
+@dataclass(frozen=True)
+class AudioRange():
+    scale: float
+    sub: float
+    threshold: int
+    bands: Tuple[Tuple[float, float], ...]
+
+
+# Finestra di analisi dei brani: campioni di ogni fft, frame tra due analisi (dimensione dei chunk,
+# le finestre si sovrappongono di fft - hop campioni) e finestra applicata ai campioni (vedi TAPERS)
+@dataclass(frozen=True)
+class Analysis():
+    fft: int = REFERENCE_SIZE
+    hop: int = REFERENCE_SIZE
+    taper: str = 'rect'
+
+
+# Lampada RGB con luce minima e massima proporzionate al valore massimo di un canale (255)
+# ed effetto: mappatura dei colori (permutazione di 'rgb' o colore fisso '#rrggbb'), banda che
+# pilota il colore fisso (indice di BANDS, None = tutte), ritardo in frame e decadimento per frame
+@dataclass(frozen=True)
+class Light():
+    name: str
+    type: str
+    min: int
+    max: int
+    color: str = 'rgb'
+    band: Optional[int] = None
+    phase: int = 0
+    decay: float = 0.0
+
+
+# Gateway dmx (un universo) con le sue luci, la politica di invio dei frame e il protocollo
+# (edmx: testo ascii del gateway ADFweb, artnet: ArtDMX binario, sacn: E1.31 binario)
+@dataclass(frozen=True)
+class Gateway():
+    name: str
+    address: str
+    port: int
+    first_chan: int
+    lights: Tuple[Light, ...]
+    maxfps: float
+    keepalive: float
+    threshold: int
+    protocol: str = 'edmx'
+    universe: int = 0
+
+
+# Sorgente dal vivo (modalità live). source: device (ingresso audio di pyaudio, device -1 = predefinito)
+# o stream (file o stream letto da ffmpeg dalla path indicata, letto in tempo reale se realtime è True).
+# Ogni hop frame viene analizzata una finestra degli ultimi window campioni
+@dataclass(frozen=True)
+class Capture():
+    source: str
+    path: str
+    device: int
+    rate: int
+    channels: int
+    hop: int
+    window: int
+    realtime: bool
+
+
+# Rilevamento dei battiti: deviazioni sopra la media per un attacco e range del tempo in bpm
+# (vedi onset.OnsetDetector). Effetti sui battiti: luce aggiunta a tutte le lampade (0-255)
+# e battiti dopo i quali cambia l'ordine dei colori (0 = mai)
+@dataclass(frozen=True)
+class Beat():
+    sensitivity: float = 2.5
+    min_bpm: float = 60.0
+    max_bpm: float = 180.0
+    flash: float = 0.0
+    rotate: int = 0
+
+
+# Aggiornamento delle luci a frequenza fissa (vedi refresh.py): aggiornamenti al secondo (0 = uno per chunk)
+# e costanti di tempo in secondi di salita e discesa dei canali
+@dataclass(frozen=True)
+class Refresh():
+    rate: float = 0.0
+    attack: float = 0.0
+    release: float = 0.0
+
+
+# Uscita audio del player. mode: blocking (scrittura bloccante nello stream) o callback
+# (lo stream chiede i dati al player), frames: frame chiesti ad ogni callback
+@dataclass(frozen=True)
+class Output():
+    mode: str = 'blocking'
+    frames: int = 1024
+
+
+# Show renderizzato (vedi show.py): file della timeline e processi usati per il rendering (0 = uno per core)
+@dataclass(frozen=True)
+class Show():
+    path: str
+    workers: int = 0
+
+
+# Impostazioni della telemetria, argomenti di telemetry.Telemetry
+@dataclass(frozen=True)
+class TelemetrySettings():
+    interval: float = 0.0
+    address: Optional[str] = None
+    port: Optional[int] = None
+
+
+# Configurazione completa letta da config.xml
+@dataclass(frozen=True)
+class Config():
+    # path del file e cartella da cui sono risolte le path relative
+    path: str
+    base: str
+    folders: Tuple[Folder, ...]
+    decoder: Decoder
+    cache: Optional[Cache]
+    prefetch: Prefetch
+    audio: AudioRange
+    sync_offset: float
+    gateways: Tuple[Gateway, ...]
+    telemetry: TelemetrySettings
+    # secondi tra due controlli delle modifiche al file, 0 = nessun ricaricamento
+    reload_interval: float
+    # sorgente della modalità live, None se il tag Capture non c'è
+    capture: Optional[Capture] = None
+    beat: Beat = Beat()
+    output: Output = Output()
+    show: Show = Show('show.scl')
+    library: Library = Library('library.json')
+    refresh: Refresh = Refresh()
+    analysis: Analysis = Analysis()
+    buffer: Buffer = Buffer()
+
+
+# legge gli attributi del tag passato secondo lo schema e li ritorna in un dict
+def _attrs(tag):
+    attrs = {}
+    for (name, (conv, default)) in SCHEMA[tag.tagName][1].items():
+        if tag.hasAttribute(name):
+            value = tag.attributes[name].value
+            try:
+                attrs[name] = conv(value)
+            except ValueError:
+                raise ConfigError('Valore "' + value + '" dell\'attributo ' + name + ' del tag ' + tag.tagName + ' non valido')
+        elif default is REQUIRED:
+            raise ConfigError('Attributo "' + name + '" del tag ' + tag.tagName + ' mancante')
+        else:
+            attrs[name] = default
+    return attrs
+
+
+# ritorna la lista delle tuple (tag, attributi) con il nome passato contenute in parent
+def _tags(parent, name):
+    tags = parent.getElementsByTagName(name)
+    if tags.length < 1 and SCHEMA[name][0]:
+        raise ConfigError('Nessun tag ' + name + ' trovato nel file di configurazione!')
+    return [(tag, _attrs(tag)) for tag in tags]
+
+
+# ritorna gli attributi del primo tag con il nome passato, None se il tag è opzionale e manca
+def _first(parent, name):
+    tags = _tags(parent, name)
+    return tags[0][1] if len(tags) > 0 else None
+
+
+# legge le luci collegate al tag Gateway passato
+def _lights(gw_tag, gw_name):
+    lights = []
+    for (_, attrs) in _tags(gw_tag, 'Light'):
+        if not 0 <= attrs['minlum'] <= attrs['maxlum'] <= 1:
+            raise ConfigError('Luce minima e massima della lampada ' + attrs['name'] + ' non valide')
+        color = attrs['color'].lower()
+        if not (sorted(color) == ['b', 'g', 'r'] or re.fullmatch('#[0-9a-f]{6}', color)):
+            raise ConfigError('Colore "' + attrs['color'] + '" della lampada ' + attrs['name'] + ' non valido')
+        if attrs['band'] not in BANDS + ('all',):
+            raise ConfigError('Banda "' + attrs['band'] + '" della lampada ' + attrs['name'] + ' non valida')
+        # con una permutazione ogni canale segue già la sua banda
+        if attrs['band'] != 'all' and not color.startswith('#'):
+            raise ConfigError('Banda della lampada ' + attrs['name'] + ' valida solo con un colore fisso "#rrggbb"')
+        if attrs['phase'] < 0 or not 0 <= attrs['decay'] < 1:
+            raise ConfigError('Effetto della lampada ' + attrs['name'] + ' non valido')
+        # inserimento nell'indice corrispondente alla posizione della luce nel file xml
+        lights.insert(attrs['position'], Light(
+            attrs['name'],
+            attrs['type'],
+            int(255.0 * attrs['minlum']),
+            int(255.0 * attrs['maxlum']),
+            color,
+            BANDS.index(attrs['band']) if attrs['band'] in BANDS else None,
+            attrs['phase'],
+            attrs['decay']
+        ))
+    if len(lights) < 1:
+        raise ConfigError('Nessuna luce trovata nel gateway ' + gw_name + '!')
+    return tuple(lights)
+
+
+# legge, valida e ritorna la configurazione del file passato
+def load(path):
+    try:
+        dom = md.parse(path)
+    except FileNotFoundError:
+        raise ConfigError('config.xml non presente nella cartella dei sorgenti')
+    except ExpatError as ex:
+        raise ConfigError('Errore ' + str(ex) + ' nella lettura di config.xml')
+    base = os.path.abspath(os.path.dirname(path))
+
+    # le path possono usare il separatore di windows (es. .\music)
+    folders = tuple(
+        Folder(attrs['name'], attrs['type'], os.path.normpath(os.path.join(base, attrs['path'].replace('\\', '/'))))
+        for (_, attrs) in _tags(dom, 'MusicFolder')
+    )
+    # una cartella mancante renderebbe la playlist vuota senza errori
+    for folder in folders:
+        if not os.path.isdir(folder.path):
+            raise ConfigError('Cartella ' + folder.path + ' del tag MusicFolder ' + folder.name + ' non trovata')
+
+    dec = _first(dom, 'Decoder') or {'mode': 'stream', 'rate': 44100, 'channels': 2}
+    if dec['mode'] not in ('stream', 'convert'):
+        raise ConfigError('Modalità "' + dec['mode'] + '" del tag Decoder non valida')
+    if dec['rate'] <= 0 or dec['channels'] <= 0:
+        raise ConfigError('Formato del tag Decoder non valido')
+
+    library = _first(dom, 'Library') or {'path': 'library.json', 'workers': 0}
+    if library['workers'] < 0:
+        raise ConfigError('Valori del tag Library non validi')
+    library = Library(os.path.join(base, library['path']), library['workers'])
+
+    cache = _first(dom, 'AnalysisCache')
+    if cache is not None:
+        cache = Cache(os.path.join(base, cache['path']), int(cache['maxsize'] * 1024 * 1024))  # MB -> byte
+
+    pre = _first(dom, 'Prefetch') or {'tracks': 0, 'workers': 1, 'budget': 0.0}
+    if pre['tracks'] < 0 or pre['workers'] < 1 or pre['budget'] < 0:
+        raise ConfigError('Valori del tag Prefetch non validi')
+
+    buf = _first(dom, 'Buffer')
+    if buf is not None:
+        if not 0 < buf['seconds'] <= buf['max'] or not 0 < buf['low'] < 1 or buf['budget'] <= 0:
+            raise ConfigError('Valori del tag Buffer non validi')
+        buf = Buffer(buf['seconds'], buf['max'], buf['low'], int(buf['budget'] * 1024 * 1024))  # MB -> byte
+    else:
+        buf = Buffer()
+
+    bands = []
+    for col in BANDS:
+        band = _first(dom, col)
+        if band['low'] is not None and band['high'] is not None:
+            (low, high) = (band['low'], band['high'])
+        elif band['start'] is not None and band['finish'] is not None:
+            # indici della fft completa: quelli oltre la metà sono il riflesso dei bin fino alla
+            # frequenza di Nyquist, che viene quindi inclusa
+            (low, high) = (band['start'], min(band['finish'], REFERENCE_SIZE // 2 + 1))
+            (low, high) = (low * LEGACY_RATE / REFERENCE_SIZE, high * LEGACY_RATE / REFERENCE_SIZE)
+        else:
+            raise ConfigError('Attributi "low" e "high" del tag ' + col + ' mancanti')
+        if not 0 <= low < high:
+            raise ConfigError('Range del tag ' + col + ' non valido')
+        bands.append((low, high))
+    audio = AudioRange(
+        _first(dom, 'Scale')['value'],
+        _first(dom, 'SubValue')['value'],
+        _first(dom, 'MinThreshold')['value'],
+        tuple(bands)
+    )
+
+    gateways = []
+    for (tag, attrs) in _tags(dom, 'Gateway'):
+        if attrs['protocol'] not in PROTOCOLS:
+            raise ConfigError('Protocollo "' + attrs['protocol'] + '" del gateway ' + attrs['name'] + ' non valido')
+        (port, universe, universes) = PROTOCOLS[attrs['protocol']]
+        if attrs['port'] is None and port is None:
+            raise ConfigError('Attributo "port" del tag Gateway mancante')
+        if attrs['universe'] is None:
+            attrs['universe'] = universes[0]
+        if attrs['universe'] not in universes:
+            raise ConfigError('Universo del gateway ' + attrs['name'] + ' non valido')
+        gateway = Gateway(
+            attrs['name'],
+            attrs['address'],
+            attrs['port'] if attrs['port'] is not None else port,
+            attrs['firstChannel'],
+            _lights(tag, attrs['name']),
+            attrs['maxfps'],
+            attrs['keepalive'],
+            attrs['threshold'],
+            attrs['protocol'],
+            attrs['universe']
+        )
+        # un universo dmx ha 512 canali, 3 per ogni luce RGB
+        if gateway.first_chan + len(gateway.lights) * 3 > 512:
+            raise ConfigError('Troppe luci per un universo nel gateway: ' + gateway.name)
+        gateways.append(gateway)
+
+    capture = _first(dom, 'Capture')
+    if capture is not None:
+        if capture['source'] not in ('device', 'stream'):
+            raise ConfigError('Sorgente "' + capture['source'] + '" del tag Capture non valida')
+        if capture['source'] == 'stream' and capture['path'] == '':
+            raise ConfigError('Attributo "path" del tag Capture mancante')
+        if not 0 < capture['hop'] <= capture['window'] or capture['rate'] <= 0 or capture['channels'] <= 0:
+            raise ConfigError('Formato del tag Capture non valido')
+        capture['realtime'] = capture['realtime'] != 0
+        if capture['source'] == 'stream':
+            capture['path'] = os.path.join(base, capture['path'])
+        capture = Capture(**capture)
+
+    beat = _first(dom, 'Beat')
+    if beat is not None:
+        if beat['sensitivity'] <= 0 or not 0 < beat['minbpm'] < beat['maxbpm'] or beat['rotate'] < 0:
+            raise ConfigError('Valori del tag Beat non validi')
+        beat = Beat(beat['sensitivity'], beat['minbpm'], beat['maxbpm'], beat['flash'], beat['rotate'])
+    else:
+        beat = Beat()
+
+    refresh = _first(dom, 'Refresh')
+    if refresh is not None:
+        if refresh['rate'] < 0 or refresh['attack'] < 0 or refresh['release'] < 0:
+            raise ConfigError('Valori del tag Refresh non validi')
+        refresh = Refresh(refresh['rate'], refresh['attack'], refresh['release'])
+    else:
+        refresh = Refresh()
+
+    output = _first(dom, 'Output')
+    if output is not None:
+        if output['mode'] not in ('blocking', 'callback') or output['frames'] <= 0:
+            raise ConfigError('Valori del tag Output non validi')
+        output = Output(output['mode'], output['frames'])
+    else:
+        output = Output()
+
+    analysis = _first(dom, 'Analysis')
+    if analysis is not None:
+        if analysis['fft'] < 16 or analysis['hop'] <= 0 or analysis['taper'] not in TAPERS:
+            raise ConfigError('Valori del tag Analysis non validi')
+        analysis = Analysis(analysis['fft'], analysis['hop'], analysis['taper'])
+    else:
+        analysis = Analysis()
+
+    show = _first(dom, 'Show') or {'path': 'show.scl', 'workers': 0}
+    if show['workers'] < 0:
+        raise ConfigError('Valori del tag Show non validi')
+    show = Show(os.path.join(base, show['path']), show['workers'])
+
+    tel = _first(dom, 'Telemetry')
+    telemetry = TelemetrySettings(**tel) if tel is not None else TelemetrySettings()
+    reload = _first(dom, 'Reload')
+
+    return Config(
+        path,
+        base,
+        folders,
+        Decoder(dec['mode'], dec['rate'], dec['channels']),
+        cache,
+        Prefetch(pre['tracks'], pre['workers'], int(pre['budget'] * 1024 * 1024)),  # MB -> byte
+        audio,
+        (_first(dom, 'Sync') or {'offset': 0.0})['offset'],
+        tuple(gateways),
+        telemetry,
+        reload['interval'] if reload is not None else 1.0,
+        capture,
+        beat,
+        output,
+        show,
+        library,
+        refresh,
+        analysis,
+        buf
+    )
+
+
+# Controlla periodicamente la data di modifica di config.xml e lo rilegge quando cambia.
+# Della nuova configurazione vengono adottati solo AudioRange, luce minima e massima ed effetti
+# delle lampade, le altre modifiche richiedono il riavvio. Ogni processo ha il proprio watcher.
+class ConfigWatcher():
+    def __init__(self, config):
+        self.config = config
+        self._mtime = self._stat()
+        self._next_check = 0.0
+
+    def _stat(self):
+        try:
+            return os.stat(self.config.path).st_mtime_ns
+        except OSError:
+            return None
+
+    # da chiamare ad ogni iterazione del processo, now: time.monotonic().
+    # Ritorna la nuova configurazione se AudioRange o le luci sono cambiati, altrimenti None
+    def poll(self, now):
+        if self.config.reload_interval <= 0 or now < self._next_check:
+            return None
+        self._next_check = now + self.config.reload_interval
+        mtime = self._stat()
+        if mtime is None or mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            new = load(self.config.path)
+        except ConfigError as ex:
+            print('Configurazione non ricaricata: ' + str(ex))
+            return None
+        gateways = []
+        if len(self.config.gateways) != len(new.gateways):
+            # gateway aggiunti o rimossi: restano quelli attuali con le loro luci
+            print('Numero di gateway cambiato, richiede il riavvio')
+            gateways = self.config.gateways
+        else:
+            for (old, gw) in zip(self.config.gateways, new.gateways):
+                if len(old.lights) != len(gw.lights):
+                    print('Numero di luci del gateway ' + old.name + ' cambiato, richiede il riavvio')
+                    gateways.append(old)
+                else:
+                    gateways.append(replace(old, lights=gw.lights))
+        config = replace(self.config, audio=new.audio, gateways=tuple(gateways))
+        if config == self.config:
+            return None
+        self.config = config
+        return config
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+# Classe base dei codificatori dei frame dmx.
+# I valori minimi e massimi di ogni lampada sono tenuti in array numpy: la normalizzazione
+# di tutte le lampade avviene con una sola chiamata. Le sottoclassi scrivono i valori
+# nel buffer preallocato del frame del loro protocollo con _write().
+class DMXEncoder():
+    # first_chan: primo canale del gateway, mins e maxs: luce minima e massima di ogni lampada (0-255)
+    def __init__(self, first_chan, mins, maxs):
+        self.first_chan = first_chan
+        self.set_limits(mins, maxs)
+        self.lights = len(self.mins)
+        # valori dei canali (lampade x 3) dell'ultimo frame codificato
+        self.values = np.zeros((self.lights, 3), dtype=np.int64)
+
+    # imposta luce minima e massima di ogni lampada, usate dal frame successivo
+    def set_limits(self, mins, maxs):
+        self.mins = np.asarray(mins, dtype=np.int64).reshape(-1, 1)
+        self.maxs = np.asarray(maxs, dtype=np.int64).reshape(-1, 1)
+
+    # normalizza i colori (lampade x 3) tra minimo e massimo di ogni lampada in self.values
+    def _normalize(self, colors):
+        np.clip(colors, self.mins, self.maxs, out=self.values)
+        np.clip(self.values, 0, 255, out=self.values)
+        return self.values
+
+    # normalizza i colori (lampade x 3) tra minimo e massimo di ogni lampada e scrive il frame.
+    # Ritorna il buffer interno, valido fino alla chiamata successiva
+    def encode(self, colors):
+        self._normalize(colors)
+        return self._write()
+
+    # scrive il frame con valori (lampade x 3) già normalizzati, letti da uno show renderizzato.
+    # Ritorna il buffer interno, valido fino alla chiamata successiva
+    def load(self, values):
+        self.values[:] = values
+        return self._write()
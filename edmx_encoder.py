@@ -0,0 +1,32 @@
+from dmx_encoder import DMXEncoder
+import numpy as np
+
+# tabella dei due caratteri esadecimali (minuscoli) in ascii per ogni valore di un canale
+HEX_TABLE = np.frombuffer(''.join('{:02x}'.format(v) for v in range(256)).encode(), dtype=np.uint8).reshape(256, 2)
+
+
+# Classe che codifica i frame EDMX per il gateway ADFweb.
+# Il payload esadecimale viene scritto in un bytearray preallocato dietro
+# all'intestazione EDMX, calcolata una sola volta.
+class EDMXEncoder(DMXEncoder):
+    # first_chan: primo canale del gateway, mins e maxs: luce minima e massima di ogni lampada (0-255)
+    def __init__(self, first_chan, mins, maxs):
+        super(EDMXEncoder, self).__init__(first_chan, mins, maxs)
+        # intestazione: EDMX + canale di partenza + numero di canali da scrivere
+        self.header = ('EDMX' + '{:03d}'.format(first_chan) + '{:03d}'.format(self.lights * 3)).encode()
+        # buffer del frame, riscritto ad ogni chiamata di encode()
+        self.frame = bytearray(len(self.header) + self.lights * 6)
+        self.frame[:len(self.header)] = self.header
+        # vista del payload: una riga di due caratteri per ogni canale
+        self._payload = np.frombuffer(self.frame, dtype=np.uint8, offset=len(self.header)).reshape(-1, 2)
+        # frame che spegne tutte le luci
+        self.alloff = self.header + b'0' * (self.lights * 6)
+
+    # scrive nel frame i valori normalizzati delle lampade
+    def _write(self):
+        self._payload[:] = HEX_TABLE[self.values.reshape(-1)]
+        return self.frame
+
+    # ritorna il frame che spegne tutte le luci
+    def off(self):
+        return self.alloff
@@ -0,0 +1,74 @@
+import numpy as np
+
+# ordini dei colori selezionabili con rgb_order del sender: banda che pilota ogni canale (r, g, b)
+RGB_ORDERS = ((0, 1, 2), (1, 0, 2), (2, 1, 0))
+
+
+# matrice (canali x bande) della mappatura dei colori di una lampada.
+# color: permutazione di 'rgb' (es. 'grb': il rosso segue la banda Green, il verde la Red)
+# o colore fisso '#rrggbb' la cui intensità segue la banda band (indice, None = media delle bande)
+def color_matrix(color, band=None):
+    matrix = np.zeros((3, 3))
+    if color.startswith('#'):
+        rgb = np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)]) / 255.0
+        if band is None:
+            matrix[:] = rgb[:, np.newaxis] / 3
+        else:
+            matrix[:, band] = rgb
+    else:
+        for (ch, c) in enumerate(color):
+            matrix[ch, 'rgb'.index(c)] = 1.0
+    return matrix
+
+
+# Motore degli effetti di tutte le lampade.
+# Ogni lampada ha una mappatura dei colori (bande -> canali), un ritardo in frame rispetto
+# all'audio per gli effetti di inseguimento e una costante di decadimento.
+# Lo stato è tenuto in array (lampade x 3) e tutte le lampade sono calcolate con
+# poche operazioni numpy per frame, senza cicli sulle lampade.
+class EffectEngine():
+    # lights: lampade (config.Light) nell'ordine dei canali dei gateway
+    def __init__(self, lights):
+        self.lights = len(lights)
+        # storico dei livelli delle bande degli ultimi frame, per i ritardi
+        self._history = np.zeros((1, 3))
+        self._pos = 0
+        self.update(lights)
+        # livelli (lampade x 3) dell'ultimo frame e loro copia intera passata ai codificatori
+        self._state = np.zeros((self.lights, 3))
+        self.values = np.zeros((self.lights, 3), dtype=np.int64)
+
+    # applica gli effetti di una nuova configurazione con lo stesso numero di lampade.
+    # Livelli, decadimento in corso e storico sono mantenuti, le luci non hanno salti
+    def update(self, lights):
+        # matrici di mappatura dei colori (lampade x canali x bande)
+        self.mapping = np.stack([color_matrix(l.color, l.band) for l in lights])
+        # ritardo in frame di ogni lampada
+        self.phase = np.array([l.phase for l in lights], dtype=np.int64)
+        # frazione del livello mantenuta ad ogni frame, 0 = nessun decadimento
+        self.decay = np.array([l.decay for l in lights]).reshape(-1, 1)
+        # lo storico cresce se serve un ritardo maggiore, i frame già scritti restano alla loro età
+        size = int(self.phase.max()) + 1
+        if size > len(self._history):
+            ages = np.arange(len(self._history))
+            history = np.zeros((size, 3))
+            history[(self._pos - ages) % size] = self._history[(self._pos - ages) % len(self._history)]
+            self._history = history
+
+    # calcola i colori di tutte le lampade dalle energie delle bande di un chunk.
+    # scale e sub: fattore di scala e valore sottratto di AudioRange, order: indice di RGB_ORDERS,
+    # flash: luce aggiunta a tutti i canali (lampo sui battiti).
+    # Ritorna l'array interno (lampade x 3), valido fino alla chiamata successiva
+    def render(self, features, scale, sub, order=0, flash=0.0):
+        levels = features[list(RGB_ORDERS[order])] * scale - sub
+        # scrittura dei livelli nello storico e lettura con il ritardo di ogni lampada
+        self._pos = (self._pos + 1) % len(self._history)
+        self._history[self._pos] = levels
+        delayed = self._history[(self._pos - self.phase) % len(self._history)]
+        target = np.einsum('nij,nj->ni', self.mapping, delayed)
+        if flash:
+            target += flash
+        # il livello sale subito e scende al ritmo del decadimento
+        np.maximum(target, self._state * self.decay, out=self._state)
+        np.copyto(self.values, self._state, casting='unsafe')
+        return self.values
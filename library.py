@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import json
+import wave
+import re
+import os
+
+'''
+NB: - l'indice è un file json: path assoluta del file -> record del brano
+    - un file viene analizzato di nuovo solo se dimensione o data di modifica sono cambiate
+    - i file con un formato non valido restano nell'indice con il loro errore, per non essere riletti
+      ad ogni avvio. Se l'errore è del sistema (ffmpeg assente, file non accessibile) il file
+      viene riletto alla scansione successiva
+'''
+
+# estensioni dei file musicali
+EXTENSIONS = ('.mp3', '.wav')
+# canali dei layout indicati da ffmpeg
+LAYOUTS = {'mono': 1, 'stereo': 2, 'quad': 4, '5.0': 5, '5.1': 6, '7.1': 8}
+
+
+# legge formato e durata di un file compresso dalle informazioni stampate da ffmpeg.
+# La larghezza dei campioni è quella dell'audio decodificato (16 bit)
+def _probe_ffmpeg(path):
+    proc = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-i', path], stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    info = proc.stderr.decode(errors='replace')
+    duration = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', info)
+    audio = re.search(r'Audio: [^\n]*?(\d+) Hz, ([^,\n]+)', info)
+    if duration is None or audio is None:
+        raise ValueError('nessuno stream audio')
+    layout = audio.group(2).strip()
+    channels = re.match(r'(\d+) channels', layout)
+    (h, m, s) = duration.groups()
+    return {
+        'duration': int(h) * 3600 + int(m) * 60 + float(s),
+        'rate': int(audio.group(1)),
+        'channels': int(channels.group(1)) if channels is not None else LAYOUTS.get(layout, 0),
+        'width': 2
+    }
+
+
+# legge formato e durata del file musicale. Solleva un'eccezione se il file non è leggibile
+def probe(path):
+    if path.lower().endswith('.wav'):
+        wf = wave.open(path, 'rb')
+        try:
+            return {
+                'duration': wf.getnframes() / wf.getframerate(),
+                'rate': wf.getframerate(),
+                'channels': wf.getnchannels(),
+                'width': wf.getsampwidth()
+            }
+        finally:
+            wf.close()
+    return _probe_ffmpeg(path)
+
+
+# Indice dei brani delle cartelle musicali salvato su disco.
+# Per ogni file registra path, dimensione, data di modifica, durata, frequenza di campionamento,
+# canali e larghezza dei campioni. Ad ogni scansione vengono letti (da un pool di thread) solo
+# i file nuovi o modificati, gli altri sono presi dall'indice.
+class MusicLibrary():
+    # path: file dell'indice, workers: thread che leggono i file (0 = uno per core)
+    def __init__(self, path, workers=0):
+        self.path = path
+        self.workers = workers if workers > 0 else os.cpu_count()
+        # record dei brani per path assoluta
+        self.tracks = {}
+        try:
+            with open(path) as f:
+                self.tracks = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as ex:
+            # indice illeggibile: viene ricostruito
+            print('Errore ' + str(ex) + ' nella lettura dell\'indice della libreria')
+
+    # legge il file e ritorna il suo record, con il campo error se non è leggibile
+    # e retry se l'errore non dipende dal file (va riletto alla scansione successiva)
+    def _record(self, path, st):
+        record = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime}
+        try:
+            record.update(probe(path))
+        except OSError as ex:
+            record['error'] = str(ex)
+            record['retry'] = True
+        except Exception as ex:
+            record['error'] = str(ex)
+        return record
+
+    # salva l'indice su un file temporaneo e lo rinomina, un indice a metà non viene mai letto
+    def _save(self):
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.tracks, f)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as ex:
+            print('Errore ' + str(ex) + ' nel salvataggio dell\'indice della libreria')
+
+    # scansiona la cartella e aggiorna l'indice.
+    # Ritorna i record dei brani leggibili ordinati per path
+    def scan(self, folder):
+        found = {}
+        for (root, _, files) in os.walk(folder):
+            for file in files:
+                # i file _conv.wav sono le conversioni temporanee degli mp3 (Decoder mode="convert")
+                if os.path.splitext(file)[1].lower() in EXTENSIONS and not file.endswith('_conv.wav'):
+                    path = os.path.join(root, file)
+                    try:
+                        found[path] = os.stat(path)
+                    except OSError:
+                        continue
+        # file nuovi o modificati dall'ultima scansione, o non letti per un errore del sistema
+        changed = [
+            path for (path, st) in found.items()
+            if path not in self.tracks or self.tracks[path]['size'] != st.st_size or self.tracks[path]['mtime'] != st.st_mtime
+            or self.tracks[path].get('retry', False)
+        ]
+        # file della cartella non più presenti
+        prefix = os.path.join(folder, '')
+        removed = [path for path in self.tracks if path.startswith(prefix) and path not in found]
+        for path in removed:
+            del self.tracks[path]
+        if len(changed) > 0:
+            with ThreadPoolExecutor(self.workers) as pool:
+                for record in pool.map(lambda path: self._record(path, found[path]), changed):
+                    self.tracks[record['path']] = record
+                    if 'error' in record:
+                        print('File ' + record['path'] + ' non leggibile: ' + record['error'])
+        if len(changed) > 0 or len(removed) > 0:
+            self._save()
+        tracks = [self.tracks[path] for path in sorted(found)]
+        bad = sum(1 for track in tracks if 'error' in track)
+        if bad > 0:
+            print(str(bad) + ' file non leggibili saltati nella cartella ' + folder)
+        return [track for track in tracks if 'error' not in track]
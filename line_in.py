@@ -0,0 +1,173 @@
+from multiprocessing import Process
+from dataclasses import asdict
+from ring_buffer import EOPLAYLIST
+from spectral_features import FeatureExtractor, downmix
+from onset import OnsetDetector
+from music_reader import FFmpegPipe
+from telemetry import Telemetry
+from config import ConfigWatcher
+import numpy as np
+import pyaudio
+import time
+import wave
+
+'''
+NB: - in modalità live non c'è il player: il sender è l'unico consumatore del buffer circolare
+    - ogni cella contiene solo le feature, con l'istante in cui l'audio è stato catturato
+    - se il sender resta indietro le analisi nuove vengono scartate invece di accumulare ritardo
+'''
+
+
+# Ingresso audio di pyaudio letto a blocchi di hop frame.
+# Espone gli stessi metodi usati del lettore di wave.
+class DeviceSource():
+    def __init__(self, rate, channels, hop, device=-1):
+        self.rate = rate
+        self.channels = channels
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=rate,
+            input=True,
+            frames_per_buffer=hop,
+            input_device_index=device if device >= 0 else None
+        )
+
+    def getsampwidth(self):
+        return 2
+
+    def getnchannels(self):
+        return self.channels
+
+    def getframerate(self):
+        return self.rate
+
+    # legge n frame, se la lettura è in ritardo i dati persi dall'ingresso vengono ignorati
+    def readframes(self, n):
+        return self._stream.read(n, exception_on_overflow=False)
+
+    def close(self):
+        self._stream.close()
+        self._pa.terminate()
+
+
+# Lettore (wave o FFmpegPipe) che restituisce i frame al ritmo con cui verrebbero catturati:
+# n frame non sono disponibili prima che sia passato il tempo della loro durata.
+# Usato al posto dell'ingresso audio per le prove e le misure di latenza.
+class PacedSource():
+    def __init__(self, wf):
+        self.wf = wf
+        self._start = None
+        self._frames = 0
+
+    def getsampwidth(self):
+        return self.wf.getsampwidth()
+
+    def getnchannels(self):
+        return self.wf.getnchannels()
+
+    def getframerate(self):
+        return self.wf.getframerate()
+
+    def readframes(self, n):
+        if self._start is None:
+            self._start = time.monotonic()
+        raw = self.wf.readframes(n)
+        self._frames += len(raw) // (self.getsampwidth() * self.getnchannels())
+        # attesa dell'istante in cui l'ultimo frame letto sarebbe stato catturato
+        delay = self._start + self._frames / self.getframerate() - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return raw
+
+    def close(self):
+        self.wf.close()
+
+
+# apre la sorgente indicata dalle impostazioni del tag Capture
+def open_source(capture):
+    if capture.source == 'device':
+        return DeviceSource(capture.rate, capture.channels, capture.hop, capture.device)
+    if capture.path.endswith('.wav'):
+        wf = wave.open(capture.path, 'rb')
+    else:
+        wf = FFmpegPipe(capture.path, capture.rate, capture.channels)
+    return PacedSource(wf) if capture.realtime else wf
+
+
+# Sottoclasse di Process che cattura l'audio dal vivo (ingresso audio o stream) al posto di
+# reader e player. Ogni hop frame la finestra degli ultimi window campioni scorre e ne vengono
+# calcolate le energie delle bande e i battiti, scritte nel buffer circolare per il sender insieme
+# all'istante di cattura. La latenza tra cattura e invio è quindi di un hop più il tempo di analisi.
+class LineIn(Process):
+    # config: configurazione letta da config.xml (vedi config.load), deve contenere il tag Capture
+    def __init__(self, sound_data, config):
+        super(LineIn, self).__init__()
+        # buffer circolare letto dal sender
+        self.sound_data = sound_data
+        # configurazione e controllo delle sue modifiche durante l'esecuzione
+        self.config = config
+        self.watcher = ConfigWatcher(config)
+        # misure dei tempi di analisi e delle analisi scartate
+        self.stats = Telemetry('line_in', **asdict(config.telemetry))
+        # stadio di estrazione delle energie delle bande dalla fft
+        self.features = FeatureExtractor(config.audio.bands, config.audio.threshold, config.analysis.taper)
+
+    # applica i nuovi range delle bande e la nuova soglia se la configurazione è stata modificata
+    def _reload(self):
+        config = self.watcher.poll(time.monotonic())
+        if config is not None:
+            self.features = FeatureExtractor(config.audio.bands, config.audio.threshold, config.analysis.taper)
+            self.config = config
+            self.stats.count('reloads')
+            print('Configurazione ricaricata')
+
+    # funzione innescata quando viene chiamato start() sull'istanza nel main
+    def run(self):
+        print('Run line in')
+        capture = self.config.capture
+        try:
+            source = open_source(capture)
+        except Exception as ex:
+            print('Errore ' + str(ex) + ' nell\'apertura della sorgente')
+            self.sound_data.put_marker(EOPLAYLIST)
+            return
+        channels = source.getnchannels()
+        dtype = 'int{0}'.format(source.getsampwidth() * 8)
+        # finestra degli ultimi campioni (media dei canali), aggiornata ad ogni hop
+        window = np.zeros(capture.window)
+        # rilevatore dei battiti, una finestra ogni hop
+        beat = self.config.beat
+        onset = OnsetDetector(capture.hop / source.getframerate(), beat.sensitivity, beat.min_bpm, beat.max_bpm)
+        try:
+            while True:
+                # applicazione delle modifiche alla configurazione
+                self._reload()
+                raw = source.readframes(capture.hop)
+                # istante di cattura dell'ultimo frame letto
+                captured = time.monotonic()
+                if len(raw) < 1:  # fine dello stream
+                    break
+                start = time.perf_counter()
+                samples = downmix(raw, dtype, channels)
+                n = len(samples)
+                # scorrimento della finestra: i campioni più vecchi escono, quelli nuovi entrano in fondo
+                window[:-n] = window[n:]
+                window[-n:] = samples
+                features = self.features.extract(window[np.newaxis], source.getframerate(), onset)[0]
+                self.stats.observe('fft', time.perf_counter() - start)
+                # il sender legge sempre l'analisi più recente: se è rimasto indietro e il buffer è pieno
+                # la nuova analisi sostituisce l'ultima non letta, le più vecchie vengono saltate
+                if len(self.sound_data) >= self.sound_data.capacity:
+                    self.stats.count('dropped')
+                self.sound_data.put_chunk(b'', features, captured)
+                self.stats.count('hops')
+                self.stats.tick()
+        except Exception as ex:
+            print('Errore ' + str(ex) + ' nella cattura')
+        finally:
+            source.close()
+            # inserimento keyword di fine lettura, il sender spegne le luci e termina
+            self.sound_data.put_marker(EOPLAYLIST)
+            print('Cattura terminata')
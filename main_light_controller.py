@@ -1,49 +1,131 @@
-from multiprocessing import Manager, log_to_stderr, get_logger
+from multiprocessing import Queue, log_to_stderr, get_logger
+from ring_buffer import SharedRingBuffer, capacity_for, FRAME_BYTES
+from spectral_features import FEATURES
+from config import ConfigError
+import config
+import threading
 import logging
+import queue
+import sys
+import os
 import music_reader
 import music_player
 import udp_sender
+import line_in
+import show
 
 '''
-interazione con manager.list
-push() -> append(value)
-pop()  -> pop(0)
+interazione con il buffer circolare
+push() -> put_chunk(raw, features) / put_marker(kind)
+pop()  -> get(consumatore) + advance(consumatore)
+
+modalità di avvio (primo argomento da riga di comando):
+process -> reader, player e sender in tre processi separati (default)
+thread  -> reader, player e sender su tre thread di un solo processo
+live    -> cattura dal vivo (tag Capture) e sender in due processi separati, senza riproduzione
+render  -> analizza la playlist e salva i valori delle luci nel file dello show (tag Show), poi termina
+show    -> come process, ma il sender invia i valori dello show renderizzato senza analizzare l'audio
 '''
 
+# numero massimo di analisi presenti nel buffer in modalità live
+LIVE_MAXLEN = 4
+
+
+# esegue i processi passati ognuno su un thread del processo principale, senza memoria condivisa
+# né altri interpreti. Le attese su file, audio e buffer bloccano solo il thread che le esegue
+def run_threads(*stages):
+    threads = [threading.Thread(target=stage.run) for stage in stages]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+
 if __name__ == '__main__':
+    # lettura modalità di avvio
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'process'
+    if mode not in ('process', 'thread', 'live', 'render', 'show'):
+        print('Modalità "' + mode + '" non valida, usare process, thread, live, render o show')
+        exit(1)
+    # lettura e validazione del file di configurazione, condiviso da tutti i processi
+    try:
+        cfg = config.load(os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])), 'config.xml'))
+    except ConfigError as ex:
+        print(str(ex))
+        exit(1)
+    if mode == 'live' and cfg.capture is None:
+        print('Nessun tag Capture trovato nel file di configurazione!')
+        exit(1)
+    if mode == 'render':
+        # rendering dello show in parallelo, senza riproduzione
+        try:
+            index = show.render(cfg)
+        except OSError as ex:
+            print('Errore ' + str(ex) + ' nel rendering dello show')
+            exit(1)
+        print('Show salvato in ' + cfg.show.path + ': ' + str(len(index['tracks'])) + ' brani')
+        exit(0)
+    # indice dei brani dello show renderizzato
+    timeline = None
+    if mode == 'show':
+        try:
+            timeline = show.read_index(cfg)
+        except (OSError, ValueError) as ex:
+            print('Errore ' + str(ex) + ' nella lettura dello show, eseguire prima il rendering')
+            exit(1)
     # setup per il logger della componente multiprocessing
     log_to_stderr()
     logger = get_logger()
     logger.setLevel(logging.INFO)
-    # setup manager per la gestione dei buffer e eventi condivisi tra processi
-    with Manager() as manager:
-        # buffer contenente Chunk (Dati musicali: frequenze grezze e fft)
-        sound_data = manager.list()
-        # buffer contenente dict dei metadati delle canzoni
-        meta_data = manager.list()
-        # dict contenente gli eventi per la sincronizzazione dei processi e dimensione massima del buffer
-        events = {
-            'can_reproduce': manager.Event(),
-            'can_send': manager.Event(),
-            'can_read': manager.Event(),
-            'MAXLEN': 100
-        }
-        # inizializzazione degli eventi
-        events['can_reproduce'].clear()
-        events['can_send'].clear()
-        events['can_read'].set()
-
+    # buffer circolare contenente i chunk (Dati musicali: frequenze grezze e energie delle bande)
+    # in memoria condivisa tra processi o locale in modalità thread
+    if mode == 'live':
+        # in modalità live il sender legge direttamente le analisi dell'audio catturato,
+        # poche celle per non accumulare ritardo e senza dati grezzi
+        sound_data = SharedRingBuffer(LIVE_MAXLEN, FRAME_BYTES, len(FEATURES), (('sender', None),), latest=True)
+    else:
+        # il player legge per primo, il sender legge solo i chunk già rilasciati dal player.
+        # Le celle occupano al massimo il budget in byte del tag Buffer, il reader ne riempie
+        # solo i secondi di audio indicati dai livelli (vedi prefetch.ReadAhead)
+        slot_bytes = cfg.analysis.hop * FRAME_BYTES
+        sound_data = SharedRingBuffer(
+            capacity_for(cfg.buffer.budget, slot_bytes, len(FEATURES)), slot_bytes, len(FEATURES),
+            (('player', None), ('sender', 'player')), shared=(mode != 'thread')
+        )
+    # coda contenente dict dei metadati delle canzoni
+    meta_data = queue.Queue() if mode == 'thread' else Queue()
+    try:
         # creazione istanze delle classi necessarie a sincronizzare luci e musica
-        re = music_reader.MusicReader(sound_data, meta_data, events)
-        pl = music_player.MusicPlayer(sound_data, meta_data, events)
-        se = udp_sender.UdpSender(sound_data, meta_data, events)
-
-        # start dei processi
-        re.start()
-        pl.start()
-        se.start()
-
-        # join (attesa da parte del main che i processi abbiano terminato il loro compito)
-        re.join()
-        pl.join()
-        se.join()
+        try:
+            if mode == 'live':
+                stages = (
+                    line_in.LineIn(sound_data, cfg),
+                    udp_sender.UdpSender(sound_data, meta_data, cfg)
+                )
+            else:
+                stages = (
+                    music_reader.MusicReader(sound_data, meta_data, cfg, timeline),
+                    music_player.MusicPlayer(sound_data, meta_data, cfg),
+                    udp_sender.UdpSender(
+                        sound_data, meta_data, cfg, show.ShowBuilder(cfg) if mode == 'show' else None
+                    )
+                )
+        except OSError as ex:
+            # cartella della cache non creabile o gateway non raggiungibile
+            print('Errore ' + str(ex) + ' nell\'avvio')
+            exit(1)
+
+        if mode == 'thread':
+            # esecuzione di lettura, riproduzione e invio nel processo principale
+            run_threads(*stages)
+        else:
+            # start dei processi
+            for stage in stages:
+                stage.start()
+            # join (attesa da parte del main che i processi abbiano terminato il loro compito)
+            for stage in stages:
+                stage.join()
+    finally:
+        # rilascio della memoria condivisa
+        sound_data.close()
+        sound_data.unlink()
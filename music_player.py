@@ -1,90 +1,304 @@
 from multiprocessing import Process
-from dataclasses import dataclass
-import numpy as np
+from dataclasses import asdict
+from ring_buffer import CHUNK, EOSONG, EOPLAYLIST
+from telemetry import Telemetry
+import threading
 import pyaudio
-
-
-# classe per la gestione dei dati musicali, contiene frequenze grezze e fft
-@dataclass
-class Chunk():
-    # frequenze grezze
-    raw: bytes
-    # modulo della trasformata di fouriers
-    fft: np.array
+import queue
+import time
 
 
 # Classe che implementa un processo per la riproduzione dei file audio.
-# Esso legge i Chunk nel buffer e li esegue nello stream di output audio.
-# Ad ogni brano apre lo stream in base ai suoi metadati, alla fine lo chiude.
-# I Chunk vengono letti senza eseguire il pop(), lasciando il dato all' UdpSender
-# Appena prima di riprodurre autorizza il processo di invio.
+# Esso legge i chunk nel buffer circolare e li esegue nello stream di output audio.
+# Ad ogni brano apre lo stream in base ai suoi metadati; se il brano successivo ha lo stesso
+# formato lo stream resta aperto e i brani vengono riprodotti senza pause tra uno e l'altro.
+# Appena prima di riprodurre un chunk scrive nel buffer l'istante in cui sarà udibile,
+# calcolato dal clock dello stream e dalla sua latenza di output, e lo rilascia
+# autorizzando il processo di invio a leggerlo dallo stesso buffer.
+# In modalità callback è lo stream a chiedere i frame: la callback copia i chunk dal buffer
+# circolare in un buffer preallocato e, se il chunk successivo non è pronto, riproduce silenzio
+# contando il buco invece di bloccarsi. A fine brano, se il successivo ha lo stesso formato,
+# la callback continua a leggerlo senza inserire silenzio.
 class MusicPlayer(Process):
-    # inizializzazione oggetto player, vengono passati i buffer per i dati e quello per gli eventi
-    def __init__(self, sound_data, meta_data, events):
+    # inizializzazione oggetto player, vengono passati il buffer circolare e la coda dei metadati
+    # config: configurazione letta da config.xml (vedi config.load)
+    def __init__(self, sound_data, meta_data, config):
         super(MusicPlayer, self).__init__()
-        # buffers condivisi tra processi
+        # buffer circolare in memoria condivisa e coda dei metadati
         self.sound_data = sound_data
         self.meta_data = meta_data
-        self.events = events
+        # modalità di uscita audio e frame per callback
+        self.output = config.output
+        # misure dei tempi di scrittura audio, buchi nell'audio ed errori
+        self.stats = Telemetry('player', **asdict(config.telemetry))
+        # metadati della canzone in riproduzione
+        self.meta = None
+        # istante, nel clock dello stream, in cui verrà riprodotto il prossimo frame scritto
+        self.next_play = 0.0
+        # istanza di pyaudio, una sola per tutta la playlist, creata nel processo in run()
+        self._pa = None
+        # stato della modalità callback, creato in run() (gli oggetti di threading non passano tra processi)
+        self._song_end = None
+        self._playing = False
+        # chunk in riproduzione copiato dal buffer circolare e byte già riprodotti
+        self._pending = None
+        # due buffer preallocati usati a turno: la parte finale di un chunk resta valida
+        # mentre il successivo viene copiato nell'altro
+        self._buffers = None
+        self._pending_len = 0
+        self._pending_pos = 0
+        # True tra la cella EOSONG e il primo chunk del brano successivo, metadati del brano
+        # successivo letti dalla callback e lasciati al thread principale (formato diverso)
+        self._between = False
+        self._next_meta = None
+        # silenzio di una callback e dimensione di un frame del formato corrente
+        self._silence = b''
+        self._frame_bytes = 0
+        # latenza di output usata se lo stream non indica l'istante di riproduzione
+        self._latency = 0.0
 
-    # legge i metadati nel buffer -> apre e ritorna uno stream di output audio
-    def _open_stream(self):
+    # legge i metadati dalla coda -> ritorna lo stream di output audio aperto se il formato
+    # del brano è lo stesso, altrimenti lo chiude e ne apre uno nuovo
+    def _open_stream(self, out_stream=None):
         try:
             # lettura metadati della canzone
-            meta = self.meta_data.pop(0)
-            # creazione stream di output audio
-            return pyaudio.PyAudio().open(
-                format=meta['format'],
-                channels=meta['channels'],
-                rate=meta['frame_rate'],
+            prev = self.meta
+            if self._next_meta is not None:
+                (self.meta, self._next_meta) = (self._next_meta, None)
+            else:
+                self.meta = self.meta_data.get()
+            self._between = False
+            if out_stream is not None and self._same_format(prev, self.meta):
+                # la callback riprende a leggere dal buffer circolare
+                self._song_end.clear()
+                self._playing = True
+                return out_stream
+            if out_stream is not None:
+                # attesa della riproduzione dei frame già nello stream
+                out_stream.stop_stream()
+                out_stream.close()
+            self.next_play = 0.0
+            self._frame_bytes = self.meta['channels'] * pyaudio.get_sample_size(self.meta['format'])
+            callback = None
+            if self.output.mode == 'callback':
+                # silenzio per il formato del brano, riusato da tutte le callback
+                self._silence = bytes(self.output.frames * self._frame_bytes)
+                self._pending_len = self._pending_pos = 0
+                self._song_end.clear()
+                self._playing = True
+                callback = self._callback
+            # creazione stream di output audio, nella modalità callback la riproduzione parte subito
+            out_stream = self._pa.open(
+                format=self.meta['format'],
+                channels=self.meta['channels'],
+                rate=self.meta['frame_rate'],
                 output=True,
+                frames_per_buffer=self.output.frames,
+                stream_callback=callback
             )
+            self._latency = out_stream.get_output_latency()
+            return out_stream
         except Exception as ex:
+            self._playing = False
             print('Errore: ' + str(ex) + ' durante apertura stream')
-            exit(0)
             return None
 
+    # True se i due brani possono essere riprodotti dallo stesso stream
+    def _same_format(self, meta, other):
+        return all(meta[k] == other[k] for k in ('format', 'channels', 'frame_rate'))
+
+    # ritorna l'istante (time.monotonic) in cui sarà udibile il chunk di frames frame che
+    # sta per essere scritto nello stream: clock dello stream più latenza di output
+    def _presentation_time(self, out_stream, frames):
+        now = out_stream.get_time()
+        # se lo stream è rimasto senza dati il chunk verrà riprodotto subito
+        if 0 < self.next_play < now:
+            self.stats.count('underruns')
+            self.sound_data.underrun()
+        self.next_play = max(self.next_play, now)
+        stamp = self.next_play + out_stream.get_output_latency()
+        self.next_play += frames / self.meta['frame_rate']
+        # conversione dal clock dello stream a quello di sistema, comune a tutti i processi
+        return stamp - now + time.monotonic()
+
     # riproduce un solo brano
     def _play(self, out_stream):
         if out_stream is not None:
             print('Riproduzione canzone iniziata')
             # iterazione all'interno del brano
             while True:
-                try:
-                    # se è terminato il brano
-                    if str(self.sound_data[0]) == 'EOSong':
-                        # chiusura dello stream
-                        out_stream.close()
-                        # wakeup sender
-                        self.events['can_send'].set()
-                        # se è finita la playlist
-                        if str(self.sound_data[1]) == 'EOPlaylist':
-                            print('Playlist Terminata')
-                            # terminazione processo
-                            exit(0)
-                        print('Canzone terminata')
-                        break
-                    # se continua la normale esecuzione e la prima cella del buffer è di tipo chunk
-                    elif isinstance(self.sound_data[0], Chunk):
-                        # lettura dati 'grezzi' di un chunk musicale dal buffer
-                        raw = self.sound_data[0].raw
-                        # wakeup sender
-                        self.events['can_send'].set()
-                        # riproduzione musica
+                # attesa del prossimo chunk nel buffer
+                slot = self.sound_data.get('player')
+                # se è terminato il brano lo stream resta aperto per il brano successivo
+                if slot.kind == EOSONG:
+                    # rilascio della keyword e wakeup sender
+                    self.sound_data.advance('player')
+                    print('Canzone terminata')
+                    break
+                # se continua la normale esecuzione e la cella è un chunk
+                elif slot.kind == CHUNK:
+                    # lettura dati 'grezzi' del chunk, pyaudio accetta solo buffer in sola lettura
+                    raw = slot.pcm.tobytes()
+                    released = False
+                    try:
+                        # istante in cui il chunk sarà udibile, letto dal sender
+                        self.sound_data.stamp('player', self._presentation_time(out_stream, len(raw) // self._frame_bytes))
+                        # rilascio del chunk e wakeup sender
+                        self.sound_data.advance('player')
+                        released = True
+                        # riproduzione musica, il tempo di blocco indica quanto audio è in coda nello stream
+                        start = time.perf_counter()
                         out_stream.write(raw)
-                except Exception as ex:
-                    print('Errore: ' + str(ex) + 'in __play')
+                        self.stats.observe('write', time.perf_counter() - start)
+                    except Exception as ex:
+                        # errore sul chunk: viene saltato, non riletto all'infinito
+                        if not released:
+                            self.sound_data.advance('player')
+                        self.stats.count('errors')
+                        print('Errore: ' + str(ex) + 'in __play')
+                    self.stats.count('chunks')
+                    self.stats.tick()
+
+    # copia nel buffer preallocato il prossimo chunk del brano, chiamata dalla callback.
+    # filled: byte già scritti nel buffer della callback, time_info: tempi passati dallo stream.
+    # Ritorna False se non c'è un chunk da riprodurre (buco o fine del brano)
+    def _next_chunk(self, filled, time_info):
+        slot = self.sound_data.get('player', 0)
+        if slot is None:
+            # il reader non ha ancora scritto il chunk: la callback non aspetta e riproduce silenzio.
+            # Tra due brani non è un buco, il reader sta ancora aprendo il brano successivo
+            if not self._between:
+                self.stats.count('underruns')
+                self.sound_data.underrun()
+            return False
+        if self._between and not self._next_song(slot):
+            return False
+        if slot.kind == EOSONG:
+            # fine del brano: la cella viene rilasciata subito e si prova a continuare con il successivo
+            self.sound_data.advance('player')
+            self._between = True
+            return self._next_chunk(filled, time_info)
+        if slot.kind != CHUNK:
+            self._playing = False
+            self._song_end.set()
+            return False
+        length = len(slot.pcm)
+        self._pending = self._buffers[1] if self._pending is self._buffers[0] else self._buffers[0]
+        self._pending[:length] = slot.pcm
+        self._pending_len = length
+        self._pending_pos = 0
+        # istante in cui il primo frame del chunk sarà udibile: inizio del buffer della callback
+        # nel dac più i frame che lo precedono nel buffer, convertito nel clock di sistema
+        dac = time_info.get('output_buffer_dac_time', 0)
+        latency = dac - time_info['current_time'] if dac > 0 else self._latency
+        offset = filled / self._frame_bytes / self.meta['frame_rate']
+        self.sound_data.stamp('player', time.monotonic() + latency + offset)
+        # rilascio del chunk e wakeup sender, i dati restano nel buffer preallocato
+        self.sound_data.advance('player')
+        self.stats.count('chunks')
+        return True
+
+    # cella successiva alla EOSONG di un brano, letta dalla callback. Ritorna True se è il primo
+    # chunk di un brano con lo stesso formato, che la callback riproduce senza pause; False se i suoi
+    # metadati non sono ancora arrivati (nuovo tentativo alla callback successiva) o se il brano
+    # passa al thread principale: cambio di formato, brano vuoto o fine della playlist
+    def _next_song(self, slot):
+        if slot.kind == CHUNK:
+            try:
+                meta = self.meta_data.get_nowait()
+            except queue.Empty:
+                return False
+            self._between = False
+            if self._same_format(self.meta, meta):
+                self.meta = meta
+                self.stats.count('gapless')
+                return True
+            self._next_meta = meta
+        self._between = False
+        self._playing = False
+        self._song_end.set()
+        return False
+
+    # callback dello stream: riempie il buffer di frame_count frame con i chunk del brano e
+    # completa con silenzio se i dati non sono pronti. Non si blocca mai sul buffer circolare
+    def _callback(self, in_data, frame_count, time_info, status):
+        start = time.perf_counter()
+        size = frame_count * self._frame_bytes
+        if len(self._silence) != size:
+            self._silence = bytes(size)
+        # parti del chunk in riproduzione, unite in un solo buffer alla fine
+        parts = []
+        filled = 0
+        loaded = 0
+        try:
+            while filled < size:
+                if self._pending_pos >= self._pending_len:
+                    # dal terzo chunk della stessa callback i buffer vengono riusati: le parti già prese sono copiate
+                    if loaded > 0:
+                        parts = [b''.join(parts)]
+                    loaded += 1
+                    if not self._playing or not self._next_chunk(filled, time_info):
+                        break
+                n = min(size - filled, self._pending_len - self._pending_pos)
+                parts.append(self._pending[self._pending_pos:self._pending_pos + n])
+                self._pending_pos += n
+                filled += n
+        except Exception as ex:
+            self.stats.count('errors')
+            print('Errore: ' + str(ex) + ' in __callback')
+        if filled < size:
+            parts.append(self._silence[:size - filled])
+        self.stats.observe('callback', time.perf_counter() - start)
+        self.stats.tick()
+        # pyaudio accetta solo buffer in sola lettura: una copia per callback
+        return (b''.join(parts), pyaudio.paContinue)
+
+    # attende che la callback abbia riprodotto il brano e quelli successivi con lo stesso formato.
+    # Le celle EOSONG sono rilasciate dalla callback
+    def _play_callback(self, out_stream):
+        print('Riproduzione canzone iniziata')
+        while not self._song_end.wait(0.5):
+            if not out_stream.is_active():
+                raise RuntimeError('stream di output interrotto')
+        print('Canzone terminata')
 
     def run(self):
         print("Run music_player")
+        self._pa = pyaudio.PyAudio()
+        self._song_end = threading.Event()
+        self._buffers = (memoryview(bytearray(self.sound_data.slot_bytes)), memoryview(bytearray(self.sound_data.slot_bytes)))
+        self._pending = self._buffers[0]
+        # stream di output, chiuso a fine playlist o al cambio di formato
+        out_stream = None
         # scorre nella playlist
         while True:
-            # attende il wakeup
-            self.events['can_reproduce'].wait()
+            # attende il wakeup: il primo dato del brano successivo
+            slot = self.sound_data.get('player')
             try:
+                # se è finita la playlist
+                if slot.kind == EOPLAYLIST:
+                    self.sound_data.advance('player')
+                    print('Playlist Terminata')
+                    break
+                # brano vuoto (file non aperto o senza audio): non ci sono metadati da leggere
+                elif slot.kind == EOSONG:
+                    self.sound_data.advance('player')
+                    continue
+                # apertura dello stream, se fallisce termina la riproduzione
+                out_stream = self._open_stream(out_stream)
+                if out_stream is None:
+                    break
                 # riproduzione di un brano
-                self._play(self._open_stream())
+                if self.output.mode == 'callback':
+                    self._play_callback(out_stream)
+                else:
+                    self._play(out_stream)
             except Exception as ex:
                 print('Errore run player: ' + ex.__repr__())
                 break
+        if out_stream is not None:
+            # attesa della riproduzione degli ultimi frame
+            out_stream.stop_stream()
+            out_stream.close()
+        self._pa.terminate()
         print('Riproduzione generale terminata')
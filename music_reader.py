@@ -1,90 +1,145 @@
 from multiprocessing import Process
-from xml.dom import minidom as md
-from music_player import Chunk
-from scipy.fftpack import fft
+from dataclasses import asdict
+from ring_buffer import EOSONG, EOPLAYLIST, FRAME_BYTES
+from spectral_features import FeatureExtractor, FEATURES, downmix
+from onset import OnsetDetector
+from analysis_cache import AnalysisCache
+from telemetry import Telemetry
+from prefetch import MemoryBudget, Prefetcher, ReadAhead
+from library import MusicLibrary
+from config import ConfigWatcher
 from collections import deque
 import numpy as np
+import math
+from numpy.lib.stride_tricks import sliding_window_view
 import subprocess
+import time
 import pyaudio
 import wave
-import sys
 import os
 
 '''
 NB: - popleft() e append per gestire la lista dei file
-    - a fine canzone ci sarà una cella 'EOSong' nei buffer
+    - a fine canzone ci sarà una cella EOSONG nel buffer circolare
 '''
 
 
+# Lettore dei frame PCM decodificati da ffmpeg e letti direttamente dalla sua pipe di output.
+# Il formato è fissato in partenza (frequenza di campionamento, canali, 16 bit) e il file
+# non viene mai scritto su disco. Espone gli stessi metodi usati del lettore di wave.
+class FFmpegPipe():
+    def __init__(self, path, rate=44100, channels=2):
+        self.rate = rate
+        self.channels = channels
+        # avvio di ffmpeg con output pcm 16 bit little endian sullo stdout
+        self._proc = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'panic', '-i', path,
+             '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(channels), '-ar', str(rate), '-'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE
+        )
+
+    def getsampwidth(self):
+        return 2
+
+    def getnchannels(self):
+        return self.channels
+
+    def getframerate(self):
+        return self.rate
+
+    # legge fino a n frame, attende che ffmpeg li abbia decodificati. b'' a fine file
+    def readframes(self, n):
+        return self._proc.stdout.read(n * self.channels * self.getsampwidth())
+
+    # chiude la pipe e termina ffmpeg se non ha ancora finito
+    def close(self):
+        self._proc.stdout.close()
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+
+
 # Sottoclasse di Process che si occupa della lettura dei file musicali nelle
 # cartelle indicate nel file di configurazione.
-# Se il file non è wave lo converte;
-# Legge i file uno ad uno e carica metadati in un buffer e i dati musicali nell'altro;
-# I dati musicali, frequeze e la fft calcolata sono contenuti in un Chunk;
+# Se il file non è wave lo decodifica in streaming con ffmpeg (o lo converte su disco);
+# Mentre un brano viene letto, i successivi vengono aperti e letti in anticipo da un pool di thread;
+# Legge i file uno ad uno e carica metadati in una coda e i dati musicali nel buffer circolare;
+# Dalla fft della finestra che termina con ogni chunk (tag Analysis, canali ridotti a uno) vengono
+# calcolate le energie delle bande Red, Green e Blue e i battiti;
+# I dati musicali, frequeze e le energie delle bande sono scritti una sola volta in una cella del buffer;
+# In modalità show non esegue l'analisi: al posto delle feature scrive la riga dello show renderizzato;
 class MusicReader(Process):
-    def __init__(self, sound_data, meta_data, events):
+    # config: configurazione letta da config.xml (vedi config.load)
+    # timeline: indice dello show renderizzato (vedi show.read_index) per la modalità show, None altrimenti
+    def __init__(self, sound_data, meta_data, config, timeline=None):
         super(MusicReader, self).__init__()
-        # buffers condivisi tra processi
+        # buffer circolare in memoria condivisa e coda dei metadati
         self.sound_data = sound_data
         self.meta_data = meta_data
-        self.events = events
-        # lettura configurazioni
-        try:
-            file_folder = os.path.abspath(os.path.dirname(sys.argv[0]))
-            config_file = md.parse(file_folder + '\config.xml')
-        except FileNotFoundError:
-            print('config.xml non presente nella cartella dei sorgenti')
-            exit(1)
-
-        # gestione cartelle con file audio
-        fol_tags = config_file.getElementsByTagName('MusicFolder')
-        if fol_tags.length < 1:
-            # se non ci sono cartelle
-            print('Nessuna cartella impostata nel file di configurazione!')
-            exit(1)
-        # path assoluta di questo file
-        abs_path = os.path.abspath(os.path.dirname(sys.argv[0]))
-        # crea<ione lista contenente tutte le cartelle musicali
+        # configurazione e controllo delle sue modifiche durante l'esecuzione
+        self.config = config
+        self.watcher = ConfigWatcher(config)
+        # misure dei tempi di analisi e dell'occupazione del buffer
+        self.stats = Telemetry('reader', **asdict(config.telemetry))
+        # brani dello show: path relativa -> (prima riga, numero di righe)
+        self.timeline = timeline
+
+        # lista delle cartelle musicali con i brani indicizzati, creata da scan()
+        self.folders = []
+
+        # cache delle analisi (senza tag AnalysisCache la cache è disabilitata)
+        self.cache = None
+        if config.cache is not None:
+            self.cache = AnalysisCache(config.cache.path, config.cache.max_bytes)
+
+        # stadio di estrazione delle energie delle bande dalla fft
+        self.features = FeatureExtractor(config.audio.bands, config.audio.threshold, config.analysis.taper)
+        # numero di chunk elaborati con una sola chiamata alla fft
+        self.batch_size = 8
+
+    # applica la configurazione se è stata modificata: i chunk letti da questo momento
+    # vengono analizzati con i nuovi range delle bande e la nuova soglia
+    def _reload(self):
+        config = self.watcher.poll(time.monotonic())
+        if config is not None:
+            if config.audio.bands != self.config.audio.bands or config.audio.threshold != self.config.audio.threshold:
+                self.features = FeatureExtractor(config.audio.bands, config.audio.threshold, config.analysis.taper)
+            self.config = config
+            self.stats.count('reloads')
+            print('Configurazione ricaricata')
+
+    # aggiorna l'indice della libreria (solo i file nuovi o modificati vengono letti) e crea
+    # la lista delle cartelle con i loro brani. I file non leggibili sono scartati prima della riproduzione
+    def scan(self):
+        library = MusicLibrary(self.config.library.path, self.config.library.workers)
         self.folders = []
-        # iterazione per ogni tag folder del xml
-        for fol_t in fol_tags:
-            # creazione coda per gestire le path dei file presenti nella cartella
-            files = deque()
-            # determinazione path assolute dei files
-            # r=root, d=directories, f = files
-            for r, d, f in os.walk(abs_path):
-                for file in f:
-                    # se il file è un file musicale
-                    if '.mp3' in file or '.wav' in file:
-                        # aggiunta della path del file alla coda che gestisce i file
-                        files.append(os.path.join(r, file))
+        # iterazione per ogni cartella della configurazione
+        for folder in self.config.folders:
+            if not os.path.isdir(folder.path):
+                print('Cartella ' + folder.path + ' non trovata')
+            tracks = [track for track in library.scan(folder.path) if self._fits(track)]
             # append alla lista folders del dict contenente i dati della cartella e path dei file audio presenti
-            try:
-                self.folders.append({
-                    'name': fol_t.attributes['name'].value,  # nome del file
-                    'type': fol_t.attributes['type'].value,  # tipo di file contenuti (mp3, wav) (il programma non ne tiene conto)
-                    'path': abs_path + fol_t.attributes['path'].value, # path assoluta della cartella
-                    'files': files
-                })
-            except Exception as ex:
-                print(ex)
-
-        # acquisizione soglia fft
-        trs = config_file.getElementsByTagName('MinThreshold')
-        if trs.length < 1:
-            # se non c'è
-            print('Nessuna soglia trovato nel file di configurazione!')
-            exit(1)
-        else:
-            # se ci sono fattori
-            try:
-                self.trs_val = int(trs[0].attributes['value'].value)
-            except KeyError as ke:
-                print('Attributo "' + str(ke).split("'")[1] + '" di un tag Threshold mancante')
-                exit(1)
-            except ValueError as ve:
-                print('Valore "' + str(ve).split("'")[1] + '"di un tag Threshold non convertibile in float')
-                exit(1)
+            self.folders.append({
+                'name': folder.name,  # nome della cartella
+                'type': folder.type,  # tipo di file contenuti (mp3, wav) (il programma non ne tiene conto)
+                'path': folder.path,  # path assoluta della cartella
+                'tracks': tracks,  # record dei brani nell'indice (durata, formato)
+                'files': deque(track['path'] for track in tracks)
+            })
+        return self.folders
+
+    # un chunk del brano decodificato deve stare in una cella del buffer circolare: i brani con più
+    # di 2 canali o campioni più larghi di 4 byte sono scartati prima della riproduzione.
+    # Gli mp3 decodificati in streaming hanno il formato del tag Decoder
+    def _fits(self, track):
+        channels = track['channels']
+        if track['path'].lower().endswith('.mp3') and self.config.decoder.mode == 'stream':
+            channels = self.config.decoder.channels
+        if channels * track['width'] > FRAME_BYTES:
+            print('File ' + track['path'] + ' non supportato dal buffer: ' + str(channels) + ' canali da ' + str(track['width']) + ' byte')
+            return False
+        return True
 
     # converte il file mp3 passato in wav con l'uso di un software esterno ffmpeg
     # ritorna la path del file convertito o None se si sono verificati errori
@@ -102,22 +157,32 @@ class MusicReader(Process):
             return None
 
     # apre il file referenziato, ne legge i metadati e ritorna il descrittore
-    def _open(self, path):
+    # se decode è True il file viene decodificato in streaming da ffmpeg
+    # i metadati vengono scritti nella coda solo all'inizio della lettura (vedi _read)
+    def _open(self, path, decode=False):
         if path is not None:
             print('Inizio apertura file: ' + path)
             try:
                 # apertura file referenziato dalla path in lettura
-                wf = wave.open(path, 'rb')
-                # scrittura di un dict nel buffer contenente i metadati della canzone. Utilizzati dal player
-                self.meta_data.append({
-                    'chunk_size': 1024,  # wf.getframerate() // 50,   grandezza in frame degli spezzoni da leggere. Equivale a un decimo di secondo
+                if decode:
+                    wf = FFmpegPipe(path, self.config.decoder.rate, self.config.decoder.channels)
+                else:
+                    wf = wave.open(path, 'rb')
+                # creazione del dict contenente i metadati della canzone. Utilizzati dal player
+                meta = {
+                    'chunk_size': self.config.analysis.hop,  # grandezza in frame degli spezzoni da leggere, frame tra due analisi
                     'format': pyaudio.get_format_from_width(wf.getsampwidth()),  # formato del file audio
                     'channels': wf.getnchannels(),  # numero di canali
                     'frame_rate': wf.getframerate(),  # numero di campionamenti o frame al secondo
                     'dtype': 'int{0}'.format(wf.getsampwidth() * 8)  # formato dei valori contenuti nel file
-                })
-                # ritorna il file descriptor, tipo di dati e numero di frame da leggere
-                return (wf, self.meta_data[-1]['dtype'], self.meta_data[-1]['chunk_size'])
+                }
+                # un chunk deve stare in una cella del buffer circolare
+                if self.sound_data is not None and meta['chunk_size'] * wf.getnchannels() * wf.getsampwidth() > self.sound_data.slot_bytes:
+                    print('Formato del file non supportato dal buffer')
+                    wf.close()
+                    return None
+                # ritorna il file descriptor, tipo di dati, numero di frame da leggere e metadati
+                return (wf, meta['dtype'], meta['chunk_size'], meta)
             except Exception as ex:
                 print('Errore ' + str(ex) + ' nell\'apertura del file')
                 return None
@@ -125,60 +190,248 @@ class MusicReader(Process):
         else:
             return None
 
-    # legge il file musicale dall'inizio alla fine
-    def _read(self, data):
-        if data is not None:
+    # parametri che determinano il risultato dell'analisi, usati come chiave della cache
+    def _analysis_params(self, chunk_size):
+        return {
+            'chunk_size': chunk_size,
+            'threshold': self.config.audio.threshold,
+            'bands': self.config.audio.bands,
+            'analysis': self.config.analysis,
+            'decoder': self.config.decoder,
+            'beat': (self.config.beat.sensitivity, self.config.beat.min_bpm, self.config.beat.max_bpm)
+        }
+
+    # apre il brano (convertendolo o decodificandolo se mp3) e ritorna il dict con lo stato
+    # della sua lettura, None se non è stato possibile aprirlo
+    def _load(self, file):
+        conv_file = None
+        ext = os.path.splitext(file)[1].lower()
+        # se il file è un mp3
+        if ext == '.mp3' and self.config.decoder.mode == 'stream':
+            # decodifica in streaming del file
+            data = self._open(file, decode=True)
+        elif ext == '.mp3':
+            # conversione del file con la funzione __convert
+            conv_file = self._convert(file)
+            data = self._open(conv_file)
+        # se il file è un wav
+        elif ext == '.wav':
+            data = self._open(file)
+        else:
+            data = None
+        if data is None:
+            if conv_file is not None and os.path.exists(conv_file):
+                os.remove(conv_file)
+            return None
+        (wf, dtype, chunk_size, meta) = data
+        track = {
+            'path': file,  # file sorgente del brano
+            'conv': conv_file,  # file convertito da eliminare a fine lettura
+            'wf': wf,
+            'dtype': dtype,
+            'chunk_size': chunk_size,
+            'meta': meta,
+            'cached': None,  # feature del brano già presenti in cache (array in memory-map) o None
+            'params': self._analysis_params(chunk_size),  # parametri dell'analisi, chiave della cache
+            'computed': [],  # feature calcolate durante la lettura, salvate in cache a fine brano (None se non valide)
+            'index': 0,  # numero di chunk già analizzati
+            'head': deque(),  # blocchi (dati grezzi, feature, byte riservati) letti in anticipo
+            'head_bytes': 0,  # byte riservati dal budget per i blocchi letti in anticipo
+            'tail': np.zeros(self.config.analysis.fft),  # ultimi campioni (un canale) della finestra di analisi
+            # rilevatore dei battiti del brano, con lo stato dei chunk precedenti
+            'onset': OnsetDetector(
+                chunk_size / meta['frame_rate'], self.config.beat.sensitivity,
+                self.config.beat.min_bpm, self.config.beat.max_bpm
+            ),
+            'rows': None,  # righe del brano nello show (prima, numero) in modalità show
+            'done': False  # True se il file è stato letto fino alla fine
+        }
+        if self.timeline is not None:
+            # un brano non renderizzato non ha righe: le luci non vengono aggiornate
+            track['rows'] = self.timeline.get(os.path.relpath(file, self.config.base), (0, 0))
+            track['computed'] = None
+        elif self.cache is not None:
+            track['cached'] = self.cache.load(file, track['params'])
+            if track['cached'] is not None:
+                print('Analisi del brano letta dalla cache')
+        return track
+
+    # legge dal brano fino a batch_size chunk e ne calcola le feature. Ritorna (dati grezzi, feature)
+    def _read_batch(self, track):
+        # lettura musica, batch_size chunk alla volta
+        raws = []
+        while len(raws) < self.batch_size:
+            raw = track['wf'].readframes(track['chunk_size'])
+            if len(raw) < 1:  # se il bramo termina
+                track['done'] = True
+                break
+            raws.append(raw)
+        # se la configurazione è stata ricaricata con altri parametri, l'analisi in cache
+        # non è più valida e quella calcolata non viene salvata
+        params = self._analysis_params(track['chunk_size'])
+        if params != track['params']:
+            track['params'] = params
+            track['cached'] = None
+            track['computed'] = None
+        (cached, index) = (track['cached'], track['index'])
+        if track['rows'] is not None:
+            # modalità show: la prima feature è la riga dello show con i valori delle luci, -1 se manca
+            (first, count) = track['rows']
+            features = np.zeros((len(raws), len(FEATURES)))
+            rows = index + np.arange(len(raws))
+            features[:, 0] = np.where(rows < count, first + rows, -1)
+        elif cached is not None and index + len(raws) <= len(cached):
+            # energie delle bande precalcolate, la fft non viene eseguita
+            features = cached[index:index + len(raws)]
+            self.stats.count('cached_chunks', len(raws))
+        elif len(raws) > 0:
+            # conversione in numpy array e calcolo delle energie delle bande di tutti i chunk letti
+            start = time.perf_counter()
+            fft = len(track['tail'])
+            channels = track['meta']['channels']
+            # canali ridotti a uno e accodati agli ultimi campioni del blocco precedente
+            stream = np.concatenate((track['tail'], downmix(b''.join(raws), track['dtype'], channels)))
+            track['tail'] = stream[-fft:]
+            # per ogni chunk la finestra di fft campioni che termina con il suo ultimo frame
+            ends = np.cumsum([len(raw) for raw in raws]) // (channels * np.dtype(track['dtype']).itemsize)
+            windows = sliding_window_view(stream, fft)[ends]
+            features = self.features.extract(windows, track['meta']['frame_rate'], track['onset'])
+            if track['computed'] is not None:
+                track['computed'].append(features)
+            # tempo di analisi per chunk
+            self.stats.observe('fft', (time.perf_counter() - start) / len(raws))
+        else:
+            features = []
+        track['index'] += len(raws)
+        return (raws, features)
+
+    # apre il brano e, se ahead è True, ne legge in anticipo i primi chunk: al massimo i secondi
+    # del livello alto iniziale del buffer e finché il budget di memoria lo permette.
+    # Il brano da riprodurre subito viene solo aperto, il primo chunk non attende la lettura anticipata.
+    # Eseguita dai thread del Prefetcher
+    def _prefetch(self, file, ahead=True):
+        track = self._load(file)
+        if track is None or not ahead:
+            return track
+        try:
+            # dimensione in byte e durata in secondi di un blocco di batch_size chunk
+            batch_bytes = self.batch_size * track['chunk_size'] * track['meta']['channels'] * track['wf'].getsampwidth()
+            batch_seconds = self.batch_size * track['chunk_size'] / track['meta']['frame_rate']
+            batches = math.ceil(self.config.buffer.seconds / batch_seconds)
+            while not track['done'] and len(track['head']) < batches and self.budget.take(batch_bytes):
+                track['head'].append(self._read_batch(track) + (batch_bytes,))
+                track['head_bytes'] += batch_bytes
+        except Exception as ex:
+            print('Errore ' + str(ex) + ' nella lettura anticipata del file')
+        return track
+
+    # legge il brano dall'inizio alla fine: prima i blocchi letti in anticipo, poi il resto del file
+    def _read(self, track):
+        if track is not None:
             print('Inizio lettura del file')
-            (wf, dtype, chunk_size) = data
+            # i metadati vanno nella coda insieme al primo chunk: un brano senza chunk (file vuoto o
+            # non decodificabile) è solo una EOSONG, che il player salta senza leggere metadati
+            published = False
+            # byte di un frame, per la durata dei chunk
+            frame_bytes = track['meta']['channels'] * track['wf'].getsampwidth()
             try:
                 while True:
-                    self.events['can_read'].wait()
-                    raw = wf.readframes(chunk_size)  # lettura musica
-                    if len(raw) < 1:  # se il bramo termina
-                        print('Lettura brano terminata')
+                    # applicazione delle modifiche alla configurazione
+                    self._reload()
+                    if len(track['head']) > 0:
+                        # il blocco letto in anticipo passa al buffer: la sua memoria torna ai brani successivi
+                        (raws, features, batch_bytes) = track['head'].popleft()
+                        track['head_bytes'] -= batch_bytes
+                        self.budget.give(batch_bytes)
+                    elif not track['done']:
+                        (raws, features) = self._read_batch(track)
+                    else:
                         break
-                    wf_data = np.frombuffer(raw, dtype=dtype)[::2]  # conversione in numpy array
-                    fft_arr = fft(np.array(wf_data, dtype=dtype)[:chunk_size])  # calcolo fft
-                    fft_arr = np.abs(fft_arr)  # calcolo modulo fft
-                    for index, val in enumerate(fft_arr):  # attuazione soglia di azzeramento
-                        if val < self.trs_val:
-                            fft_arr[index] = 0
-                    # append in coda all'array dei dati musicali(frequenze grezze e modulo dell'fft)
-                    self.sound_data.append(Chunk(raw, fft_arr))
-                    self.events['can_reproduce'].set()  # wakeup riproduzione
-                    # se il buffer è pieno
-                    if len(self.sound_data) > self.events['MAXLEN']:
-                        self.events['can_read'].clear()
+                    # livelli del buffer adattati ai buchi nell'audio segnalati dal player
+                    self.readahead.update(self.sound_data.underruns(), time.monotonic())
+                    self.stats.gauge('readahead', self.readahead.high)
+                    for (raw, feat) in zip(raws, features):
+                        start = time.perf_counter()
+                        # raggiunto il livello alto il reader si ferma finché player e sender non fanno
+                        # scendere il buffer sotto quello basso, poi lo riempie di nuovo a blocchi
+                        buffered = self.sound_data.buffered()
+                        self.stats.gauge('buffered', buffered)
+                        self.stats.gauge('depth', len(self.sound_data))
+                        if buffered >= self.readahead.high:
+                            self.stats.count('stalls')
+                            self.sound_data.wait_below(self.readahead.low)
+                        if not published:
+                            self.meta_data.put(track['meta'])
+                            published = True
+                        # scrittura nel buffer circolare dei dati musicali(frequenze grezze e energie delle bande),
+                        # attende una cella libera se è stato raggiunto il limite in byte
+                        self.sound_data.put_chunk(raw, feat, seconds=len(raw) / frame_bytes / track['meta']['frame_rate'])
+                        self.stats.observe('put_wait', time.perf_counter() - start)
+                        self.stats.count('chunks')
+                    self.stats.tick()
+                print('Lettura brano terminata')
+                # salvataggio in cache dell'analisi del brano letto per intero
+                if self.cache is not None and track['cached'] is None and track['computed']:
+                    self.cache.store(track['path'], track['params'], np.concatenate(track['computed']))
             except Exception as ex:
                 print('Errore ' + str(ex) + ' nella lettura del file')
+            finally:
+                self._close(track)
+
+    # analizza per intero il brano senza scriverlo nel buffer circolare (rendering dello show).
+    # Ritorna (metadati, feature di tutti i chunk), None se il file non è stato aperto
+    def analyze(self, file):
+        track = self._load(file)
+        if track is None:
+            return None
+        try:
+            batches = []
+            while not track['done']:
+                (_, features) = self._read_batch(track)
+                if len(features) > 0:
+                    batches.append(features)
+            features = np.concatenate(batches) if len(batches) > 0 else np.zeros((0, len(FEATURES)))
+            if self.cache is not None and track['cached'] is None and track['computed']:
+                self.cache.store(track['path'], track['params'], features)
+            return (track['meta'], features)
+        finally:
+            self._close(track)
+
+    # chiude il brano, rilascia la memoria letta in anticipo ed elimina il file convertito
+    def _close(self, track):
+        # chiusura del file (o della pipe di ffmpeg)
+        track['wf'].close()
+        track['head'].clear()
+        if track['head_bytes'] > 0:
+            self.budget.give(track['head_bytes'])
+            track['head_bytes'] = 0
+        # rimozione del file convertito
+        if track['conv'] is not None and os.path.exists(track['conv']):
+            os.remove(track['conv'])
 
     # funzione innescata quando viene chiamato start() sull'istanza nel main
     def run(self):
         print("Run read")
+        self.scan()
+        # budget di memoria per l'audio letto in anticipo e pool che prepara i brani successivi
+        self.budget = MemoryBudget(self.config.prefetch.budget)
+        # livelli in secondi del buffer circolare
+        buf = self.config.buffer
+        self.readahead = ReadAhead(buf.seconds, buf.max_seconds, buf.low)
+        prefetcher = Prefetcher(self._prefetch, self.config.prefetch.tracks, self.config.prefetch.workers)
         # per ogni cartella presente nella lista folders
         for folder in self.folders:
             print('Apertura cartella: ' + folder['name'])
-            # iterazione tra le path dei files della cartella
-            for file in folder['files']:
-                # se il file è un mp3
-                if '.mp3' in file:
-                    # conversione del file con la funzione __convert
-                    conv_file = self._convert(file)
-                    # lettura del file
-                    self._read(self._open(conv_file))
-                    # rimozione del file convertito
-                    os.remove(conv_file)
-                # se il file è un wav
-                elif '.wav' in file:
-                    # apertura e lettura del file
-                    self._read(self._open(file))
+            # iterazione tra i brani della cartella, aperti e letti in anticipo dal prefetcher
+            for track in prefetcher.tracks(folder['files']):
+                # lettura del brano
+                self._read(track)
                 # inserimento nel buffer della keyword di fine canzone
-                self.sound_data.append('EOSong')
+                self.sound_data.put_marker(EOSONG)
             # inserimento keyword di fine lettura
-            self.sound_data.append('EOPlaylist')
+            self.sound_data.put_marker(EOPLAYLIST)
             print('Brani terminati nella cartella ' + folder['name'])
 
-
 '''
 # eliminazione file wav covertiti
 items = os.listdir(folder['path'])
@@ -186,4 +439,3 @@ for item in items:
     if item.endswith('_conv.wav'):
         os.remove(os.path.join(folder['path'], item))
 '''
-s
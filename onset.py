@@ -0,0 +1,113 @@
+import numpy as np
+
+# feature aggiunte dal rilevatore, dopo le energie delle bande:
+# forza dell'attacco (spectral flux), battito (1 o 0) e tempo stimato in bpm (0 se non ancora noto)
+ONSET_FEATURES = ('onset', 'beat', 'tempo')
+# intervalli concordi necessari perché il tempo stimato sia affidabile
+LOCK_CONFIDENCE = 2
+# battiti generati dal tempo stimato senza attacchi prima di fermarsi
+MAX_MISSED = 4
+
+
+# Rilevatore incrementale di attacchi e battiti.
+# Per ogni chunk calcola lo spectral flux (somma degli aumenti del modulo logaritmico dello
+# spettro rispetto al chunk precedente) e lo confronta con una soglia adattiva, media mobile
+# esponenziale più sensitivity volte la deviazione media. Il tempo è stimato dagli intervalli
+# tra gli attacchi riportati nel range di bpm, i battiti seguono il tempo stimato e si riallineano
+# sugli attacchi. Non rilegge mai lo storico e non guarda avanti: costo costante per chunk.
+class OnsetDetector():
+    # hop: secondi tra due chunk, sensitivity: deviazioni sopra la media per un attacco,
+    # min_bpm e max_bpm: range del tempo stimato
+    def __init__(self, hop, sensitivity=2.5, min_bpm=60.0, max_bpm=180.0):
+        self.hop = hop
+        self.sensitivity = sensitivity
+        self.min_period = 60.0 / max_bpm
+        self.max_period = 60.0 / min_bpm
+        # peso dei nuovi valori nelle medie mobili (costante di tempo di un secondo)
+        self._alpha = min(1.0, hop / 1.0)
+        # modulo logaritmico dello spettro del chunk precedente
+        self._prev = None
+        # media e deviazione media dello spectral flux
+        self._mean = 0.0
+        self._dev = 0.0
+        # istante del chunk corrente, dell'ultimo attacco e dell'ultimo battito (secondi)
+        self.time = 0.0
+        self._last_onset = None
+        self._last_beat = float('-inf')
+        # periodo stimato del battito, istante previsto del prossimo e affidabilità della stima
+        self.period = None
+        self._next_beat = None
+        self._confidence = 0
+        # battiti consecutivi generati dal tempo stimato senza un attacco
+        self._missed = 0
+
+    # aggiorna il periodo stimato con l'intervallo tra due attacchi
+    def _tempo(self, interval):
+        # l'intervallo viene raddoppiato o dimezzato fino a rientrare nel range di bpm
+        while interval < self.min_period:
+            interval *= 2
+        while interval > self.max_period:
+            interval /= 2
+        if self.period is None:
+            self.period = interval
+        elif abs(interval - self.period) < 0.1 * self.period:
+            self.period += 0.2 * (interval - self.period)
+            self._confidence = min(self._confidence + 1, 8)
+        else:
+            # intervalli diversi dalla stima: dopo alcuni di seguito la stima viene sostituita
+            self._confidence -= 1
+            if self._confidence < 0:
+                self.period = interval
+                self._confidence = 0
+
+    # True se il tempo stimato è stato confermato da abbastanza intervalli
+    def locked(self):
+        return self.period is not None and self._confidence >= LOCK_CONFIDENCE
+
+    # elabora gli spettri (chunk x bin, moduli) di chunk consecutivi.
+    # Ritorna l'array (chunk x ONSET_FEATURES)
+    def update(self, spectra):
+        log_spectra = np.log1p(spectra)
+        # senza uno spettro precedente della stessa lunghezza (es. ultimo chunk del brano) il flux è nullo
+        prev = self._prev if self._prev is not None and len(self._prev) == log_spectra.shape[1] else log_spectra[0]
+        # spectral flux di tutti i chunk con una sola operazione
+        rise = np.diff(log_spectra, axis=0, prepend=prev[np.newaxis])
+        flux = np.maximum(rise, 0).mean(axis=1)
+        self._prev = log_spectra[-1]
+        out = np.zeros((len(spectra), len(ONSET_FEATURES)))
+        for (i, value) in enumerate(flux):
+            t = self.time
+            # attacco: flux sopra la soglia adattiva e distante almeno min_period dal precedente
+            onset = value > self._mean + self.sensitivity * self._dev and value > 0 \
+                and (self._last_onset is None or t - self._last_onset >= self.min_period / 2)
+            self._dev += self._alpha * (abs(value - self._mean) - self._dev)
+            self._mean += self._alpha * (value - self._mean)
+            if onset:
+                if self._last_onset is not None:
+                    self._tempo(t - self._last_onset)
+                self._last_onset = t
+            beat = False
+            if not self.locked() or self._next_beat is None:
+                # senza un tempo affidabile ogni attacco è un battito
+                beat = onset
+                self._missed = 0
+            else:
+                tolerance = 0.2 * self.period
+                if onset and self._next_beat - t < tolerance:
+                    # attacco vicino al battito previsto
+                    beat = True
+                    self._missed = 0
+                elif t >= self._next_beat and self._missed < MAX_MISSED:
+                    # nessun attacco: il battito segue il tempo stimato
+                    beat = True
+                    self._missed += 1
+                elif onset and t - self._last_beat < tolerance:
+                    # attacco subito dopo un battito previsto: riallineamento della fase
+                    self._next_beat = t + self.period
+                    self._missed = 0
+            if beat:
+                self._last_beat = t
+                self._next_beat = t + self.period if self.period is not None else None
+            out[i] = (value, 1.0 if beat else 0.0, 60.0 / self.period if self.locked() else 0.0)
+            self.time += self.hop
+        return out
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+# Politica di invio dei frame verso un gateway.
+# - i frame uguali all'ultimo inviato (o con canali che variano meno della soglia) non vengono
+#   inviati, salvo un reinvio periodico ogni keepalive secondi
+# - non vengono inviati più di max_fps frame al secondo: i frame in eccesso vengono
+#   accorpati e allo scadere dell'intervallo si invia solo l'ultimo
+class OutputPolicy():
+    # max_fps: frame massimi al secondo (0 = nessun limite), keepalive: secondi tra due reinvii
+    # dello stesso frame, threshold: variazione minima di un canale per considerare il frame cambiato
+    def __init__(self, max_fps=0.0, keepalive=1.0, threshold=0):
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.keepalive = keepalive
+        self.threshold = threshold
+        # valori dei canali e istante dell'ultimo frame inviato
+        self.last_values = None
+        self.last_time = float('-inf')
+        # True se c'è un frame accorpato in attesa di essere inviato
+        self.pending = False
+
+    # decide se il frame con i valori passati va inviato nell'istante now
+    def offer(self, values, now):
+        if self.last_values is not None and now - self.last_time < self.keepalive:
+            # se nessun canale è cambiato più della soglia il frame viene scartato
+            if np.max(np.abs(values - self.last_values)) <= self.threshold:
+                self.pending = False
+                return False
+        # se l'ultimo invio è troppo recente il frame resta in attesa
+        if now - self.last_time < self.interval:
+            self.pending = True
+            return False
+        return True
+
+    # registra l'invio del frame con i valori passati
+    def sent(self, values, now):
+        if self.last_values is None:
+            self.last_values = np.array(values)
+        else:
+            self.last_values[:] = values
+        self.last_time = now
+        self.pending = False
+
+    # secondi mancanti all'invio del frame in attesa, None se non ci sono frame in attesa
+    def wait_time(self, now):
+        if not self.pending:
+            return None
+        return max(0.0, self.last_time + self.interval - now)
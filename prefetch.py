@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+
+
+# Limite in byte della memoria usata dall'audio letto in anticipo, condiviso tra i thread
+class MemoryBudget():
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    # riserva n byte, ritorna False se il limite verrebbe superato
+    def take(self, n):
+        with self._lock:
+            if self.used + n > self.limit:
+                return False
+            self.used += n
+            return True
+
+    # rilascia n byte riservati con take()
+    def give(self, n):
+        with self._lock:
+            self.used -= n
+
+
+# Livelli del buffer circolare in secondi di audio, adattati ai buchi nell'audio del player.
+# Il reader scrive fino al livello alto e riprende solo quando il buffer scende sotto quello
+# basso, a blocchi. Ad ogni nuovo buco il livello alto cresce (fino a max_seconds); dopo CALM
+# secondi senza buchi torna a scendere verso il valore iniziale, per non tenere latenza e memoria in più.
+class ReadAhead():
+    # secondi senza buchi prima di ridurre il livello alto
+    CALM = 30.0
+
+    # seconds: livello alto iniziale (minimo), max_seconds: livello alto massimo,
+    # low: livello basso come frazione di quello alto
+    def __init__(self, seconds, max_seconds, low):
+        self.min_seconds = seconds
+        self.max_seconds = max_seconds
+        self.fraction = low
+        self.high = seconds
+        self.low = seconds * low
+        # buchi già considerati e istante dell'ultima modifica del livello
+        self._underruns = 0
+        self._changed = 0.0
+
+    def _set(self, high, now):
+        self.high = high
+        self.low = high * self.fraction
+        self._changed = now
+
+    # aggiorna i livelli con il numero di buchi segnalati dal player, now: time.monotonic()
+    def update(self, underruns, now):
+        if underruns > self._underruns:
+            self._underruns = underruns
+            self._set(min(self.high * 1.5, self.max_seconds), now)
+        elif self.high > self.min_seconds and now - self._changed > self.CALM:
+            self._set(max(self.high * 0.8, self.min_seconds), now)
+
+
+# Prepara in anticipo i brani di una playlist con un pool di thread di dimensione limitata.
+# Mentre il brano corrente viene letto, i successivi depth brani vengono aperti
+# (decodificati o convertiti) e analizzati dalla funzione load. Il brano richiesto quando
+# non è ancora stato preparato viene solo aperto, per non ritardarne la riproduzione.
+class Prefetcher():
+    # load: funzione che prepara un brano dalla sua path, load(path, ahead) con ahead False
+    # se il brano serve subito, depth: brani preparati in anticipo, workers: thread del pool
+    def __init__(self, load, depth=1, workers=1):
+        self.load = load
+        self.depth = depth
+        self.workers = max(1, workers)
+
+    # ritorna, nell'ordine della playlist, i risultati di load per ogni file
+    def tracks(self, files):
+        files = list(files)
+        futures = deque()
+        submitted = 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            try:
+                for i in range(len(files)):
+                    # avvio della preparazione del brano corrente e dei depth successivi
+                    while submitted < len(files) and submitted <= i + self.depth:
+                        futures.append(pool.submit(self.load, files[submitted], submitted > i))
+                        submitted += 1
+                    yield futures.popleft().result()
+            finally:
+                for future in futures:
+                    future.cancel()
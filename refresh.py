@@ -0,0 +1,65 @@
+from collections import deque
+import numpy as np
+import math
+
+
+# Uscita a frequenza fissa dei valori delle lampade, indipendente dalla dimensione dei chunk.
+# I colori calcolati per ogni chunk sono tenuti come fotogrammi chiave con l'istante in cui il
+# chunk è udibile; ad ogni aggiornamento il valore di ogni canale è interpolato linearmente tra
+# i due fotogrammi che circondano l'istante richiesto e poi filtrato con un attacco e un rilascio
+# esponenziali (salita e discesa con costanti di tempo diverse). Tutte le lampade sono calcolate
+# insieme con poche operazioni numpy.
+class RefreshStage():
+    # lights: numero di lampade, rate: aggiornamenti al secondo,
+    # attack e release: costanti di tempo in secondi di salita e discesa (0 = immediata)
+    def __init__(self, lights, rate, attack=0.0, release=0.0):
+        self.period = 1.0 / rate
+        # frazione della distanza dal valore richiesto recuperata ad ogni aggiornamento
+        self.attack = 1.0 - math.exp(-self.period / attack) if attack > 0 else 1.0
+        self.release = 1.0 - math.exp(-self.period / release) if release > 0 else 1.0
+        # fotogrammi chiave (istante, colori lampade x 3) in ordine di tempo
+        self.keys = deque()
+        # valori filtrati, valore interpolato e loro copia intera passata ai codificatori
+        self._state = np.zeros((lights, 3))
+        self._target = np.zeros((lights, 3))
+        self._coef = np.zeros((lights, 3))
+        self._rising = np.zeros((lights, 3), dtype=bool)
+        self.values = np.zeros((lights, 3), dtype=np.int64)
+        # False finché non è stato raggiunto il primo fotogramma
+        self.started = False
+
+    # aggiunge i colori (lampade x 3) del chunk udibile nell'istante stamp
+    def push(self, stamp, colors):
+        self.keys.append((stamp, np.array(colors, dtype=np.float64)))
+
+    # istante dell'ultimo fotogramma chiave, None se non ce ne sono
+    def last(self):
+        return self.keys[-1][0] if len(self.keys) > 0 else None
+
+    # ritorna i valori (lampade x 3) da inviare per l'istante t, None se nessun fotogramma
+    # è ancora stato raggiunto. L'array è interno, valido fino alla chiamata successiva
+    def sample(self, t):
+        # i fotogrammi superati vengono scartati, resta l'ultimo precedente a t
+        while len(self.keys) > 1 and self.keys[1][0] <= t:
+            self.keys.popleft()
+        if len(self.keys) == 0 or (not self.started and self.keys[0][0] > t):
+            return None
+        self.started = True
+        (t0, c0) = self.keys[0]
+        if len(self.keys) > 1 and t0 <= t:
+            # interpolazione lineare verso il fotogramma successivo
+            (t1, c1) = self.keys[1]
+            np.subtract(c1, c0, out=self._target)
+            self._target *= (t - t0) / (t1 - t0)
+            self._target += c0
+        else:
+            # nessun fotogramma successivo: viene mantenuto l'ultimo
+            self._target[:] = c0
+        # attacco se il valore sale, rilascio se scende
+        np.greater(self._target, self._state, out=self._rising)
+        np.copyto(self._coef, self.release)
+        np.copyto(self._coef, self.attack, where=self._rising)
+        self._state += self._coef * (self._target - self._state)
+        np.rint(self._state, out=self._target)
+        np.copyto(self.values, self._target, casting='unsafe')
+        return self.values
@@ -0,0 +1,290 @@
+from multiprocessing import shared_memory, Condition, RLock
+import threading
+from dataclasses import dataclass
+import numpy as np
+
+'''
+NB: - il buffer è scritto da un solo produttore (MusicReader) e letto da più consumatori
+    - ogni consumatore ha il proprio cursore di lettura nella memoria condivisa
+    - un consumatore può "seguire" un altro: legge solo le celle già rilasciate da quello
+    - una cella resta valida finché il consumatore non chiama advance()
+    - il buffer conta anche i secondi di audio scritti: il produttore si ferma a un livello in secondi
+      (wait_below) e viene svegliato solo quando i consumatori lo fanno scendere sotto quel livello
+'''
+
+# tipi di cella presenti nel buffer
+CHUNK = 0  # dati musicali (frequenze grezze e feature della fft)
+EOSONG = 1  # fine canzone, equivale alla keyword 'EOSong'
+EOPLAYLIST = 2  # fine lettura, equivale alla keyword 'EOPlaylist'
+
+# dimensione massima in byte di un frame: 2 canali, 4 byte per campione.
+# Una cella del buffer contiene i dati grezzi di un chunk di hop frame (tag Analysis)
+FRAME_BYTES = 2 * 4
+
+
+# vista su una cella del buffer, i dati non vengono copiati
+@dataclass
+class RingSlot():
+    # tipo di cella (CHUNK, EOSONG, EOPLAYLIST)
+    kind: int
+    # frequenze grezze
+    pcm: memoryview
+    # energie delle bande di frequenza calcolate dalla fft
+    features: np.ndarray
+    # istante (time.monotonic) in cui il chunk sarà udibile, 0 se non ancora noto
+    stamp: float
+
+
+# numero di celle di slot_bytes byte di dati grezzi e features_len feature contenute in budget byte
+def capacity_for(budget, slot_bytes, features_len):
+    # dati grezzi, feature, tipo, lunghezza, istante e secondi precedenti di ogni cella
+    return max(2, budget // (slot_bytes + 8 * (features_len + 4)))
+
+
+# Buffer circolare a capacità fissa in multiprocessing.shared_memory.
+# Le celle per i dati grezzi e per le feature sono preallocate: il reader scrive ogni
+# chunk una sola volta, il player e il sender lo leggono senza copie e senza passare
+# da un processo Manager. La notifica tra processi avviene con due Condition sullo stesso lock:
+# una per i consumatori, svegliati ad ogni cella scritta, e una per il produttore, svegliato
+# solo quando l'audio nel buffer scende sotto il livello che sta aspettando.
+# Con shared=False le celle sono in memoria locale e le Condition sono quelle dei thread,
+# per l'uso all'interno di un solo processo.
+class SharedRingBuffer():
+    # capacity: numero di celle, slot_bytes: dimensione massima in byte dei dati grezzi di un chunk
+    # features_len: numero di feature (energie delle bande) per cella
+    # consumers: tuple (nome, nome del consumatore seguito o None)
+    # latest: i consumatori leggono sempre l'ultima cella scritta, saltando quelle precedenti non lette,
+    # e a buffer pieno il produttore sostituisce l'ultima cella non letta invece di attendere
+    # (modalità live, senza keyword tra i chunk)
+    def __init__(self, capacity, slot_bytes, features_len, consumers=(('player', None), ('sender', 'player')), shared=True,
+                 latest=False):
+        if capacity < 1:
+            raise ValueError('capacity deve essere almeno 1')
+        self.capacity = capacity
+        self.slot_bytes = slot_bytes
+        self.features_len = features_len
+        self.latest = latest
+        self.consumers = tuple(name for (name, _) in consumers)
+        self.follows = {name: follow for (name, follow) in consumers}
+        for follow in self.follows.values():
+            if follow is not None and follow not in self.consumers:
+                raise ValueError('Consumatore "' + follow + '" non definito')
+        # creazione della memoria (condivisa o locale) con tutte le celle preallocate
+        self._owner = True
+        if shared:
+            self._shm = shared_memory.SharedMemory(create=True, size=self._layout_size())
+            lock = RLock()
+            self._cond = Condition(lock)
+            self._space = Condition(lock)
+        else:
+            self._shm = None
+            self._local = bytearray(self._layout_size())
+            lock = threading.RLock()
+            self._cond = threading.Condition(lock)
+            self._space = threading.Condition(lock)
+        self._map_views()
+        self._header[:] = 0
+        self._levels[:] = 0
+        self._counters[:] = 0
+
+    # offset (allineati a 8 byte) delle sezioni della memoria condivisa
+    def _layout(self):
+        sizes = (
+            ('header', 8 * (len(self.consumers) + 1)),
+            ('levels', 8 * 2),
+            ('counters', 8),
+            ('starts', 8 * self.capacity),
+            ('kinds', 8 * self.capacity),
+            ('lengths', 8 * self.capacity),
+            ('stamps', 8 * self.capacity),
+            ('features', 8 * self.capacity * self.features_len),
+            ('pcm', self.capacity * self.slot_bytes),
+        )
+        offsets = {}
+        pos = 0
+        for (name, size) in sizes:
+            offsets[name] = (pos, size)
+            pos += (size + 7) // 8 * 8
+        return offsets, pos
+
+    def _layout_size(self):
+        return max(self._layout()[1], 1)
+
+    # creazione delle viste numpy sulla memoria condivisa
+    def _map_views(self):
+        offsets, _ = self._layout()
+        buf = self._shm.buf if self._shm is not None else self._local
+
+        def view(name, dtype, shape):
+            (start, size) = offsets[name]
+            return np.ndarray(shape, dtype=dtype, buffer=buf, offset=start)
+
+        # header: [cursore di scrittura, cursori dei consumatori...]
+        self._header = view('header', np.int64, (len(self.consumers) + 1,))
+        # [secondi di audio scritti in totale, livello atteso dal produttore]
+        self._levels = view('levels', np.float64, (2,))
+        # [buchi nell'audio segnalati dal player]
+        self._counters = view('counters', np.int64, (1,))
+        # secondi di audio scritti prima di ogni cella
+        self._starts = view('starts', np.float64, (self.capacity,))
+        self._kinds = view('kinds', np.int64, (self.capacity,))
+        self._lengths = view('lengths', np.int64, (self.capacity,))
+        self._stamps = view('stamps', np.float64, (self.capacity,))
+        self._features = view('features', np.float64, (self.capacity, self.features_len))
+        self._pcm = view('pcm', np.uint8, (self.capacity, self.slot_bytes))
+
+    # il buffer viene passato ai processi: si serializzano solo nome della memoria e Condition
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_header', '_levels', '_counters', '_starts', '_kinds', '_lengths', '_stamps', '_features', '_pcm'):
+            del state[key]
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map_views()
+
+    def _cursor(self, name):
+        return 1 + self.consumers.index(name)
+
+    # numero di celle scritte e non ancora lette da tutti i consumatori
+    def __len__(self):
+        return int(self._header[0] - min(self._header[1:]))
+
+    # secondi di audio scritti e non ancora letti da tutti i consumatori
+    def buffered(self):
+        first = min(self._header[1:])
+        if first >= self._header[0]:
+            return 0.0
+        return float(self._levels[0] - self._starts[first % self.capacity])
+
+    # attende che nel buffer restino al massimo seconds secondi di audio, ritorna False se il timeout scade.
+    # Il produttore non viene svegliato ad ogni cella letta ma solo quando il livello è raggiunto
+    def wait_below(self, seconds, timeout=None):
+        with self._space:
+            self._levels[1] = seconds
+            return self._space.wait_for(lambda: self.buffered() <= seconds, timeout)
+
+    # segnala un buco nell'audio del consumatore (il chunk successivo non era ancora nel buffer)
+    def underrun(self):
+        with self._cond:
+            self._counters[0] += 1
+
+    # numero di buchi segnalati dall'avvio
+    def underruns(self):
+        return int(self._counters[0])
+
+    # attende che ci sia una cella libera e ne ritorna le viste (dati grezzi, feature)
+    # ritorna None se il timeout scade
+    def reserve(self, timeout=None):
+        with self._space:
+            # buffer pieno: il produttore viene svegliato dalla prima cella rilasciata
+            self._levels[1] = float('inf')
+            if not self._space.wait_for(lambda: len(self) < self.capacity, timeout):
+                return None
+        index = int(self._header[0] % self.capacity)
+        return (self._pcm[index], self._features[index])
+
+    # pubblica la cella riservata con reserve() e sveglia i consumatori
+    # stamp: istante in cui il chunk è udibile se già noto al produttore, altrimenti 0
+    # seconds: durata dell'audio della cella
+    def commit(self, kind=CHUNK, length=0, stamp=0.0, seconds=0.0):
+        index = int(self._header[0] % self.capacity)
+        self._kinds[index] = kind
+        self._lengths[index] = length
+        self._stamps[index] = stamp
+        with self._cond:
+            self._starts[index] = self._levels[0]
+            self._levels[0] += seconds
+            self._header[0] += 1
+            self._cond.notify_all()
+
+    # copia dati grezzi e feature nella cella index
+    def _fill(self, index, raw, features):
+        if len(raw) > self.slot_bytes:
+            raise ValueError('Chunk di ' + str(len(raw)) + ' byte maggiore della cella (' + str(self.slot_bytes) + ')')
+        self._pcm[index, :len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+        n = min(len(features), self.features_len)
+        self._features[index, :n] = features[:n]
+        self._features[index, n:] = 0
+
+    # a buffer pieno sostituisce l'ultima cella scritta se nessun consumatore la sta leggendo
+    # (vedi latest). Ritorna False se la cella non è stata sostituita
+    def _replace_last(self, raw, features, stamp):
+        with self._cond:
+            last = self._header[0] - 1
+            if len(self) < self.capacity or last <= max(self._header[1:]):
+                return False
+            index = int(last % self.capacity)
+            self._fill(index, raw, features)
+            self._kinds[index] = CHUNK
+            self._lengths[index] = len(raw)
+            self._stamps[index] = stamp
+            self._cond.notify_all()
+            return True
+
+    # scrive un chunk completo (dati grezzi e feature) nel buffer, seconds: durata del chunk
+    def put_chunk(self, raw, features, stamp=0.0, seconds=0.0):
+        if self.latest and self._replace_last(raw, features, stamp):
+            return
+        self.reserve()
+        self._fill(int(self._header[0] % self.capacity), raw, features)
+        self.commit(CHUNK, len(raw), stamp, seconds)
+
+    # scrive una keyword (EOSONG, EOPLAYLIST) nel buffer
+    def put_marker(self, kind):
+        self.reserve()
+        self.commit(kind, 0)
+
+    # cursore fino al quale il consumatore può leggere
+    def _limit(self, name):
+        follow = self.follows[name]
+        if follow is None:
+            return self._header[0]
+        return self._header[self._cursor(follow)]
+
+    # attende e ritorna la prossima cella per il consumatore senza avanzare il cursore
+    # ritorna None se il timeout scade
+    def get(self, name, timeout=None):
+        pos = self._cursor(name)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._header[pos] < self._limit(name), timeout):
+                return None
+            if self.latest:
+                # le celle non lette più vecchie dell'ultima vengono scartate
+                self._header[pos] = self._limit(name) - 1
+        index = int(self._header[pos] % self.capacity)
+        length = int(self._lengths[index])
+        return RingSlot(
+            int(self._kinds[index]),
+            memoryview(self._pcm[index])[:length],
+            self._features[index],
+            float(self._stamps[index])
+        )
+
+    # scrive nella cella corrente del consumatore l'istante in cui sarà udibile,
+    # da chiamare prima di advance() perché i consumatori che lo seguono lo leggano
+    def stamp(self, name, value):
+        index = int(self._header[self._cursor(name)] % self.capacity)
+        self._stamps[index] = value
+
+    # rilascia la cella corrente del consumatore e sveglia i consumatori che lo seguono,
+    # e il produttore se l'audio nel buffer è sceso al livello che sta aspettando
+    def advance(self, name):
+        with self._cond:
+            self._header[self._cursor(name)] += 1
+            self._cond.notify_all()
+            if self.buffered() <= self._levels[1]:
+                self._space.notify_all()
+
+    # rilascia le viste e chiude la memoria condivisa in questo processo
+    def close(self):
+        del self._header, self._levels, self._counters, self._starts, self._kinds, self._lengths, self._stamps, self._features, self._pcm
+        if self._shm is not None:
+            self._shm.close()
+
+    # elimina la memoria condivisa, da chiamare solo dal processo che l'ha creata
+    def unlink(self):
+        if self._owner and self._shm is not None:
+            self._shm.unlink()
@@ -0,0 +1,70 @@
+from dmx_encoder import DMXEncoder
+import numpy as np
+import struct
+import uuid
+
+# porta udp standard di sACN (E1.31)
+SACN_PORT = 5568
+# identificativo ACN del livello radice
+ACN_ID = b'ASC-E1.17\x00\x00\x00'
+# vettori dei livelli radice, framing e DMP
+VECTOR_ROOT_DATA = 0x00000004
+VECTOR_FRAMING_DATA = 0x00000002
+VECTOR_DMP_SET_PROPERTY = 0x02
+# dimensione dei livelli prima dei canali: radice 38, framing 77, DMP 10 byte più lo start code
+HEADER_SIZE = 126
+# priorità dei dati inviati (0-200)
+PRIORITY = 100
+
+
+# indirizzo multicast standard dell'universo
+def multicast_address(universe):
+    return '239.255.{0}.{1}'.format(universe >> 8, universe & 0xff)
+
+
+# Classe che codifica i pacchetti dati binari sACN (E1.31) per un universo.
+# Il pacchetto (livelli radice, framing e DMP e canali dell'universo fino all'ultima lampada)
+# è preallocato: ad ogni frame vengono scritti solo il numero di sequenza e i canali delle lampade.
+class SACNEncoder(DMXEncoder):
+    # first_chan: primo canale (0-511) nell'universo, mins e maxs: luce minima e massima di ogni lampada,
+    # universe: universo (1-63999), name: nome della sorgente, da cui è derivato anche il suo CID
+    def __init__(self, first_chan, mins, maxs, universe=1, name='SoundControlledLights'):
+        super(SACNEncoder, self).__init__(first_chan, mins, maxs)
+        slots = first_chan + self.lights * 3
+        size = HEADER_SIZE + slots
+        cid = uuid.uuid5(uuid.NAMESPACE_DNS, name).bytes
+        # livello radice
+        self.header = struct.pack('>HH', 0x0010, 0x0000) + ACN_ID
+        self.header += struct.pack('>HI', 0x7000 | (size - 16), VECTOR_ROOT_DATA) + cid
+        # livello framing: nome della sorgente, priorità, indirizzo di sincronizzazione,
+        # sequenza, opzioni e universo
+        self.header += struct.pack('>HI', 0x7000 | (size - 38), VECTOR_FRAMING_DATA)
+        self.header += name.encode()[:63].ljust(64, b'\x00')
+        self.header += struct.pack('>BHBBH', PRIORITY, 0, 0, 0, universe)
+        # livello DMP: tipo di indirizzi, primo indirizzo, incremento, numero di valori e start code
+        self.header += struct.pack('>HBBHHHB', 0x7000 | (size - 115), VECTOR_DMP_SET_PROPERTY, 0xa1, 0, 1, slots + 1, 0)
+        self.frame = bytearray(self.header + bytes(slots))
+        # canali delle lampade nel pacchetto (lampade x 3)
+        self._channels = np.frombuffer(
+            self.frame, dtype=np.uint8, offset=HEADER_SIZE + first_chan, count=self.lights * 3
+        ).reshape(-1, 3)
+        # numero di sequenza (0-255), il ricevitore scarta i pacchetti fuori ordine
+        self.sequence = 0
+
+    # avanza il numero di sequenza del pacchetto
+    def _next_sequence(self):
+        self.sequence = (self.sequence + 1) % 256
+        self.frame[111] = self.sequence
+
+    # scrive nel pacchetto i valori normalizzati delle lampade e il nuovo numero di sequenza
+    def _write(self):
+        self._channels[:] = self.values
+        self._next_sequence()
+        return self.frame
+
+    # ritorna il pacchetto che spegne tutte le luci
+    def off(self):
+        self.values[:] = 0
+        self._channels[:] = 0
+        self._next_sequence()
+        return self.frame
@@ -0,0 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
+from music_reader import MusicReader
+from udp_sender import FrameBuilder, make_encoder
+from telemetry import Telemetry
+import numpy as np
+import struct
+import json
+import os
+
+'''
+NB: - il file dello show contiene: intestazione (MAGIC e posizione dell'indice), righe della timeline
+      e indice json dei brani in fondo al file
+    - ogni riga contiene l'istante del chunk dall'inizio del brano (float64) e i valori già normalizzati
+      (0-255) dei canali di tutte le lampade, nell'ordine dei gateway: il file non dipende dal protocollo
+    - le righe sono lette in memory-map, in modalità show il sender copia i valori nei pacchetti
+    - il reader in modalità show scrive nella prima feature della cella la riga dello show (-1 se manca):
+      la riga è il numero del chunk nel brano, valido solo con lo stesso hop e lo stesso decoder del rendering
+'''
+
+# identificativo del formato e intestazione: MAGIC e posizione dell'indice nel file
+MAGIC = b'SCLSHOW1'
+HEADER = struct.Struct('<8sQ')
+
+
+# tipo di una riga della timeline per lights lampade
+def row_dtype(lights):
+    return np.dtype([('time', '<f8'), ('values', 'u1', (lights, 3))])
+
+
+# reader e configurazione dei processi del pool di rendering, creati una volta per processo
+_reader = None
+_config = None
+
+
+def _init_worker(config):
+    global _reader, _config
+    _config = config
+    _reader = MusicReader(None, None, config)
+
+
+# analizza il brano e calcola i valori delle luci di ogni chunk, eseguita dai processi del pool.
+# Ritorna (path relativa, metadati, righe), None se il file non è stato aperto
+def _render_track(file):
+    analysis = _reader.analyze(file)
+    if analysis is None:
+        return None
+    (meta, features) = analysis
+    # gli effetti sui battiti e delle lampade ripartono da zero ad ogni brano
+    builder = FrameBuilder(_config, Telemetry('render'))
+    rows = np.zeros(len(features), dtype=row_dtype(builder.effects.lights))
+    rows['time'] = np.arange(len(features)) * meta['chunk_size'] / meta['frame_rate']
+    for (i, feat) in enumerate(features):
+        builder.build(feat)
+        for (encoder, s) in zip(builder.encoders, builder.slices):
+            rows['values'][i, s] = encoder.values
+    return (os.path.relpath(file, _config.base), meta, rows)
+
+
+# renderizza tutti i brani della playlist nel file dello show (config.show.path).
+# I brani sono analizzati in parallelo da config.show.workers processi e scritti nell'ordine
+# della playlist. Ritorna l'indice dei brani renderizzati
+def render(config):
+    files = [file for folder in MusicReader(None, None, config).scan() for file in folder['files']]
+    lights = sum(len(gw.lights) for gw in config.gateways)
+    tracks = []
+    rows = 0
+    # scrittura su un file temporaneo e rinomina, uno show a metà non viene mai letto
+    tmp = config.show.path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+        workers = config.show.workers if config.show.workers > 0 else None
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for result in pool.map(_render_track, files):
+                if result is None:
+                    continue
+                (path, meta, values) = result
+                f.write(values.tobytes())
+                tracks.append({'path': path, 'meta': meta, 'first': rows, 'count': len(values)})
+                rows += len(values)
+                print('Brano renderizzato: ' + path)
+        index = {
+            'lights': lights,
+            'gateways': [[gw.name, len(gw.lights)] for gw in config.gateways],
+            'chunking': _chunking(config),
+            'rows': rows,
+            'tracks': tracks
+        }
+        offset = f.tell()
+        f.write(json.dumps(index).encode())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, offset))
+    os.replace(tmp, config.show.path)
+    return index
+
+
+# parametri da cui dipende la suddivisione dei brani in chunk: frame per chunk e formato del decoder
+def _chunking(config):
+    return [config.analysis.hop, config.decoder.mode, config.decoder.rate, config.decoder.channels]
+
+
+# legge l'indice json del file dello show
+def _read_header(path):
+    with open(path, 'rb') as f:
+        (magic, offset) = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or offset == 0:
+            raise ValueError('File dello show ' + path + ' non valido')
+        f.seek(offset)
+        return json.loads(f.read().decode())
+
+
+# legge l'indice dello show -> dict path relativa del brano: (prima riga, numero di righe).
+# Solleva ValueError se lo show è stato renderizzato con lampade diverse da quelle della configurazione
+# o con un'altra suddivisione in chunk (hop del tag Analysis o formato del Decoder)
+def read_index(config):
+    index = _read_header(config.show.path)
+    if index['gateways'] != [[gw.name, len(gw.lights)] for gw in config.gateways]:
+        raise ValueError('Lo show è stato renderizzato con altre lampade, ripetere il rendering')
+    if index.get('chunking') != _chunking(config):
+        raise ValueError('Lo show è stato renderizzato con altri tag Analysis o Decoder, ripetere il rendering')
+    return {track['path']: (track['first'], track['count']) for track in index['tracks']}
+
+
+# Show renderizzato letto in memory-map: le righe vengono caricate dal disco solo quando lette
+class Timeline():
+    def __init__(self, path):
+        self.index = _read_header(path)
+        if self.index['rows'] < 1:
+            raise ValueError('Lo show ' + path + ' non contiene brani')
+        self.rows = np.memmap(
+            path, dtype=row_dtype(self.index['lights']), mode='r', offset=HEADER.size, shape=(self.index['rows'],)
+        )
+
+
+# Calcolo dei frame in modalità show, stessa interfaccia di udp_sender.FrameBuilder.
+# I valori delle lampade sono letti dalla riga dello show indicata dal reader e copiati nei
+# pacchetti dei gateway: niente fft, effetti o normalizzazione durante lo show
+class ShowBuilder():
+    # config: configurazione letta da config.xml, con il file dello show in config.show.path
+    def __init__(self, config):
+        self.path = config.show.path
+        self.encoders = [make_encoder(gw) for gw in config.gateways]
+        self.slices = []
+        lights = 0
+        for gw in config.gateways:
+            self.slices.append(slice(lights, lights + len(gw.lights)))
+            lights += len(gw.lights)
+        # righe dello show, aperte in memory-map nel processo del sender al primo frame
+        self.timeline = None
+
+    # i valori dello show sono già normalizzati: le modifiche alla configurazione non si applicano
+    def reload(self, config):
+        pass
+
+    # ritorna i valori (lampade x 3) della riga dello show indicata dalla prima feature, None se manca
+    def render(self, features):
+        row = int(features[0])
+        if row < 0:
+            return None
+        if self.timeline is None:
+            self.timeline = Timeline(self.path)
+        return self.timeline.rows[row]['values']
+
+    # scrive i valori (lampade x 3), già normalizzati, nei frame dei gateway
+    def encode(self, values):
+        return [encoder.load(values[s]) for (encoder, s) in zip(self.encoders, self.slices)]
+
+    # ritorna i frame dei gateway della riga dello show indicata dalla prima feature, None se manca
+    def build(self, features):
+        values = self.render(features)
+        return self.encode(values) if values is not None else None
@@ -0,0 +1,91 @@
+from scipy.fft import rfft, rfftfreq
+from onset import ONSET_FEATURES
+import numpy as np
+
+# nomi delle bande di frequenza, nell'ordine in cui compaiono nel vettore delle feature
+BANDS = ('Red', 'Green', 'Blue')
+# tutte le feature di un chunk: energie delle bande seguite da quelle del rilevatore di battiti
+FEATURES = BANDS + ONSET_FEATURES
+# finestre applicate ai campioni prima della fft
+TAPERS = ('rect', 'hann')
+# campioni della finestra di riferimento: i moduli della fft sono riportati alla scala di una
+# finestra rettangolare di 1024 campioni, così Scale e MinThreshold non dipendono dalla dimensione della fft
+REFERENCE_SIZE = 1024
+
+
+# riduce i frame (interi interlacciati) a un solo canale, media dei canali calcolata in modo vettoriale
+def downmix(raw, dtype, channels):
+    frames = np.frombuffer(raw, dtype=dtype)
+    frames = frames[:len(frames) - len(frames) % channels].reshape(-1, channels)
+    return frames.mean(axis=1) if channels > 1 else frames[:, 0].astype(np.float64)
+
+
+# Classe che riduce i campioni audio di un chunk alle energie medie per banda.
+# Le bande sono indicate in Hz: per ogni coppia (frequenza di campionamento, campioni della fft)
+# vengono precalcolate la finestra da applicare ai campioni e la matrice di pesi che media i bin
+# della rfft di ogni banda, quindi brani con frequenze diverse e fft di dimensioni diverse usano
+# le stesse bande. Applica la soglia di azzeramento in modo vettoriale e più chunk della stessa
+# lunghezza vengono elaborati con una sola chiamata alla fft. Gli spettri possono essere passati
+# a un rilevatore di battiti.
+class FeatureExtractor():
+    # bands: lista di tuple (frequenza minima, frequenza massima) in Hz, una per banda
+    # threshold: valori del modulo della fft minori della soglia vengono azzerati
+    # taper: finestra applicata ai campioni (vedi TAPERS)
+    def __init__(self, bands, threshold, taper='rect'):
+        self.bands = tuple(bands)
+        self.threshold = threshold
+        self.taper = taper
+        # (finestra o None, matrice dei pesi delle bande) indicizzate per (frequenza, numero di campioni)
+        self._tables = {}
+
+    # ritorna la finestra (None se non serve) e la matrice (bande x bin della rfft) che calcola
+    # la media di ogni banda per n campioni a frequenza rate. La finestra include la
+    # normalizzazione dei moduli alla scala di REFERENCE_SIZE campioni
+    def _table(self, rate, n):
+        tables = self._tables.get((rate, n))
+        if tables is None:
+            window = np.hanning(n) if self.taper == 'hann' else np.ones(n)
+            window *= REFERENCE_SIZE / window.sum()
+            if np.allclose(window, 1.0):
+                window = None
+            freqs = rfftfreq(n, 1.0 / rate)
+            table = np.zeros((len(self.bands), len(freqs)))
+            for (i, (low, high)) in enumerate(self.bands):
+                k = np.flatnonzero((freqs >= low) & (freqs < high))
+                if len(k) == 0:
+                    # banda più stretta della risoluzione della fft: viene usato il bin più vicino al centro
+                    k = [int(np.argmin(np.abs(freqs - (low + min(high, freqs[-1])) / 2)))]
+                table[i, k] = 1.0 / len(k)
+            tables = (window, table)
+            self._tables[(rate, n)] = tables
+        return tables
+
+    # calcola le feature di un blocco di chunk con lo stesso numero di campioni
+    # samples: array (numero chunk x campioni) -> array (numero chunk x bande)
+    # rate: frequenza di campionamento dei campioni
+    # onset: rilevatore di battiti (onset.OnsetDetector) del brano, se presente le sue feature
+    # vengono aggiunte dopo le bande
+    def extract(self, samples, rate, onset=None):
+        (window, table) = self._table(rate, samples.shape[-1])
+        if window is not None:
+            samples = samples * window
+        spectrum = np.abs(rfft(samples, axis=-1))  # modulo della fft
+        spectrum[spectrum < self.threshold] = 0  # attuazione soglia di azzeramento
+        bands = spectrum @ table.T
+        if onset is None:
+            return bands
+        return np.hstack((bands, onset.update(spectrum)))
+
+    # calcola le feature di una lista di chunk, raggruppando quelli di uguale lunghezza
+    def extract_many(self, samples, rate, onset=None):
+        width = len(self.bands) + (len(ONSET_FEATURES) if onset is not None else 0)
+        features = np.empty((len(samples), width))
+        start = 0
+        while start < len(samples):
+            n = len(samples[start])
+            end = start
+            while end < len(samples) and len(samples[end]) == n:
+                end += 1
+            features[start:end] = self.extract(np.stack(samples[start:end]), rate, onset)
+            start = end
+        return features
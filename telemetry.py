@@ -0,0 +1,143 @@
+from socket import socket, AF_INET, SOCK_DGRAM
+import json
+import time
+import sys
+
+# numero di bucket degli istogrammi: il bucket b contiene i tempi tra 2^(b-1) e 2^b microsecondi
+BUCKETS = 32
+
+
+# Istogramma dei tempi a bucket esponenziali, registrare un valore costa poche operazioni
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # registra un tempo in secondi
+    def observe(self, seconds):
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # limite superiore in microsecondi del bucket che contiene il quantile q (al massimo il valore massimo)
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for (b, n) in enumerate(self.counts):
+            seen += n
+            if seen >= target and n > 0:
+                return min(2 ** b, round(self.max * 1e6, 1))
+        return 0
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': round(self.total * 1e6 / self.count, 1) if self.count > 0 else 0,
+            'p50_us': self.quantile(0.50),
+            'p95_us': self.quantile(0.95),
+            'p99_us': self.quantile(0.99),
+            'max_us': round(self.max * 1e6, 1)
+        }
+
+
+# Valore istantaneo (es. occupazione del buffer): ultimo, minimo, massimo e media
+class Gauge():
+    def __init__(self):
+        self.last = None
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.count = 0
+
+    def set(self, value):
+        self.last = value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.total += value
+        self.count += 1
+
+    def snapshot(self):
+        return {
+            'last': self.last,
+            'min': self.min,
+            'max': self.max,
+            'mean': round(self.total / self.count, 2) if self.count > 0 else None
+        }
+
+
+# Telemetria di un processo (reader, player, sender): contatori, istogrammi dei tempi e valori.
+# Ogni interval secondi le misure vengono scritte come riga json su stderr, o inviate
+# come datagram UDP all'indirizzo indicato, e azzerate. Con interval 0 non vengono mai scritte
+# ma restano leggibili con snapshot().
+class Telemetry():
+    def __init__(self, stage, interval=0.0, address=None, port=None):
+        self.stage = stage
+        self.interval = interval
+        self.target = (address, port) if address is not None and port is not None else None
+        self._socket = None
+        self._last_dump = time.monotonic()
+        self.reset()
+
+    # azzera tutte le misure
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    # incrementa il contatore name
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # registra un tempo in secondi nell'istogramma name
+    def observe(self, name, seconds):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        hist.observe(seconds)
+
+    # imposta il valore name
+    def gauge(self, name, value):
+        g = self.gauges.get(name)
+        if g is None:
+            g = self.gauges[name] = Gauge()
+        g.set(value)
+
+    def snapshot(self):
+        return {
+            'ts': round(time.time(), 3),
+            'stage': self.stage,
+            'counters': dict(self.counters),
+            'histograms': {name: h.snapshot() for (name, h) in self.histograms.items()},
+            'gauges': {name: g.snapshot() for (name, g) in self.gauges.items()}
+        }
+
+    # scrive le misure se è passato l'intervallo, da chiamare ad ogni iterazione del processo
+    def tick(self):
+        if self.interval > 0 and time.monotonic() - self._last_dump >= self.interval:
+            self.dump()
+
+    # scrive le misure come riga json e le azzera
+    def dump(self):
+        line = json.dumps(self.snapshot())
+        if self.target is not None:
+            if self._socket is None:
+                self._socket = socket(AF_INET, SOCK_DGRAM)
+            try:
+                self._socket.sendto(line.encode(), self.target)
+            except OSError:
+                pass
+        else:
+            print(line, file=sys.stderr)
+        self._last_dump = time.monotonic()
+        self.reset()
+
+    # il socket non viene passato ai processi figli
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_socket'] = None
+        return state
+
@@ -1,251 +1,286 @@
 from socket import socket, AF_INET, SOCK_STREAM, SOCK_DGRAM
 from multiprocessing import Process
-from xml.dom import minidom as md
-from webcolors import rgb_to_hex
-import numpy as np
-import os
-import sys
-
-
-# Classe che implementa un processo per la gestione delle stringhe da inviare al gateway dmx.
-# Quando il processo di riproduzione abilita questo processo, esso esegue l'operazione
-# di pop() dal buffer dei dati musicali e con la fft crea la stringa da inviare al gateway.
-# Esso tiene conto dei valori di massima e minima luce impostati per ogni singola lampada.
-# Dopo ogni invio esso attende il nuovo wakeup dal processo di riproduzione per inviare il
-# successivo pacchetto.
+from dataclasses import asdict
+from ring_buffer import EOSONG, EOPLAYLIST
+from edmx_encoder import EDMXEncoder
+from artnet_encoder import ArtNetEncoder
+from sacn_encoder import SACNEncoder, multicast_address
+from output_policy import OutputPolicy
+from telemetry import Telemetry
+from config import ConfigWatcher
+from effects import EffectEngine, RGB_ORDERS
+from refresh import RefreshStage
+from spectral_features import FEATURES
+import time
+
+# posizione di battito e tempo stimato nel vettore delle feature
+BEAT = FEATURES.index('beat')
+TEMPO = FEATURES.index('tempo')
+
+
+# crea il codificatore dei frame del protocollo del gateway
+def make_encoder(gw):
+    mins = [l.min for l in gw.lights]
+    maxs = [l.max for l in gw.lights]
+    if gw.protocol == 'artnet':
+        return ArtNetEncoder(gw.first_chan, mins, maxs, gw.universe)
+    elif gw.protocol == 'sacn':
+        return SACNEncoder(gw.first_chan, mins, maxs, gw.universe, gw.name)
+    return EDMXEncoder(gw.first_chan, mins, maxs)
+
+
+# Calcolo dei frame di tutti i gateway dalle feature di un chunk: effetti sui battiti,
+# effetti delle lampade e codifica nel protocollo di ogni gateway.
+# Usato dal sender durante la riproduzione e dal rendering offline dello show (vedi show.py)
+class FrameBuilder():
+    # config: configurazione letta da config.xml, stats: Telemetry su cui contare i battiti
+    def __init__(self, config, stats):
+        self.config = config
+        self.stats = stats
+        # codificatori dei gateway e fette delle loro luci nella lista di tutte le luci
+        self.encoders = [make_encoder(gw) for gw in config.gateways]
+        self.slices = []
+        lights = []
+        for gw in config.gateways:
+            self.slices.append(slice(len(lights), len(lights) + len(gw.lights)))
+            lights += gw.lights
+        # effetti di tutte le lampade, calcolati insieme ad ogni frame
+        self.effects = EffectEngine(lights)
+        # variabile che identifica il numero corrispondente all'ordine dei 3 colori rgb (vedi effects.RGB_ORDERS)
+        # esso viene cambiato ogni config.beat.rotate battiti
+        self.rgb_order = 0
+        # battiti ricevuti dall'inizio
+        self.beats = 0
+
+    # applica la nuova configurazione: fattori di AudioRange, luce minima e massima ed effetti delle lampade
+    def reload(self, config):
+        lights = []
+        for (encoder, gw) in zip(self.encoders, config.gateways):
+            encoder.set_limits([l.min for l in gw.lights], [l.max for l in gw.lights])
+            lights += gw.lights
+        self.effects.update(lights)
+        self.config = config
+
+    # converte le energie delle bande (Red, Green, Blue) calcolate dal reader nei colori delle lampade
+    # (lampade x 3). Ritorna l'array interno, valido fino alla chiamata successiva
+    def render(self, features):
+        # determinazione valori di intensità per ogni colore in base alle energie delle bande
+        # proporzionata con i valori inseriti nel file di configurazione subval e scale,
+        # poi mappati sui colori di ogni lampada dal suo effetto
+        # sui battiti: cambio dell'ordine dei colori ogni rotate battiti e lampo su tutte le lampade
+        flash = 0.0
+        if features[BEAT] > 0:
+            self.beats += 1
+            self.stats.count('beats')
+            self.stats.gauge('tempo', features[TEMPO])
+            if self.config.beat.rotate > 0 and self.beats % self.config.beat.rotate == 0:
+                self.rgb_order = (self.rgb_order + 1) % len(RGB_ORDERS)
+            flash = self.config.beat.flash
+        return self.effects.render(
+            features, self.config.audio.scale, self.config.audio.sub, self.rgb_order, flash
+        )
+
+    # normalizza i colori (lampade x 3) di ogni lampada e scrive i frame nei buffer preallocati, uno per gateway
+    def encode(self, colors):
+        return [encoder.encode(colors[s]) for (encoder, s) in zip(self.encoders, self.slices)]
+
+    # converte le feature di un chunk nei frame, uno per gateway. Ritorna None se non c'è un frame da inviare
+    def build(self, features):
+        return self.encode(self.render(features))
+
+
+# Classe che implementa un processo per la gestione delle stringhe da inviare ai gateway dmx.
+# Ogni gateway usa il proprio protocollo: EDMX ascii (ADFweb), Art-Net o sACN binari.
+# Ogni gateway pilota un universo con il proprio socket e la propria fetta di luci.
+# Quando il processo di riproduzione rilascia un chunk del buffer circolare, esso lo legge
+# e con le energie delle bande crea la stringa da inviare al gateway.
+# Esso tiene conto dei valori di massima e minima luce e dell'effetto impostati per ogni singola lampada.
+# Ogni frame viene inviato nell'istante in cui il chunk sarà udibile, indicato dal player.
+# Dopo ogni invio esso attende che il processo di riproduzione rilasci il chunk successivo
+# per inviare il successivo pacchetto.
+# Con il tag Refresh i frame non seguono più i chunk: i colori di ogni chunk diventano fotogrammi
+# chiave e un timer invia frame interpolati e filtrati alla frequenza configurata.
 class UdpSender(Process):
 
-    def __init__(self, sound_data, meta_data, events):
+    # config: configurazione letta da config.xml (vedi config.load)
+    # builder: calcolo dei frame dalle celle del buffer, di default FrameBuilder (show.ShowBuilder per gli show)
+    def __init__(self, sound_data, meta_data, config, builder=None):
         super(UdpSender, self).__init__()
-        # buffers condivisi tra processi
+        # buffer circolare in memoria condivisa e coda dei metadati
         self.sound_data = sound_data
         self.meta_data = meta_data
-        self.events = events
-        # lettura configurazioni
-        try:
-            file_folder = os.path.abspath(os.path.dirname(sys.argv[0]))
-            config_file = md.parse(file_folder + '\\config.xml')
-        except FileNotFoundError:
-            print('config.xml non presente nella cartella dei sorgenti')
-            exit(1)
-        # acquisizione gateway
-        gw = config_file.getElementsByTagName('Gateway')
-        if gw.length < 1:
-            # se non ci sono gateway
-            print('Nessun gateway trovato nel file di configurazione!')
-            exit(1)
-        elif gw.length > 1:
-            # se ci sono piu tag Gateway
-            print('Più di un gateway, verrà utilizzato il: ' + gw[0].attributes['name'].value)
-        try:
-            self.gname = gw[0].attributes['name'].value  # nome del gateway
-            self.address = gw[0].attributes['address'].value  # indirizzo ip del gateway
-            self.port = int(gw[0].attributes['port'].value)  # indirizzo di porta
-            self.first_chan = int(gw[0].attributes['firstChannel'].value)
-            # primo canale del gateway da utilizzare
-        except KeyError as ke:
-            print('Attributo "' + str(ke).split("'")[1] + '" del tag Gateway mancante')
-            exit(1)
-
-        # acquisizione luci configurate nel file
-        li_tags = config_file.getElementsByTagName('Light')
-        if li_tags.length < 1:
-            # se non ci sono luci
-            print('Nessuna luce trovata nel file di configurazione!')
-            exit(1)
-        else:
-            # se ci sono luci
-            self.lights = []
-            # iterazione tra i tag Light
-            for l in li_tags:
-                try:
-                    # inserimento nell'array delle luci
-                    # nell'indice corrispondente alla posizione della luce nel file xml
-                    # del dict contenente:
-                    #   tipo di luce(non usato, si da per scontato che sia RGB)
-                    #   luce minima e massima impostate nel file xml proporzionate al valore massimo
-                    #   di un canale (255)
-                    self.lights.insert(
-                        int(l.attributes['position'].value),
-                        {
-                            'type': l.attributes['type'].value,
-                            'min': int(255.0 * float(l.attributes['minlum'].value)),
-                            'max': int(255.0 * float(l.attributes['maxlum'].value))
-                        }
-                    )
-                except KeyError as ke:
-                    print('Attributo "' + str(ke).split("'")[1] + '" di un tag Lights mancante')
-                    exit(1)
-                except ValueError as ve:
-                    print('Valore "' + str(ve).split("'")[1] + '"tag Lights non conv. in float')
-                    exit(1)
-
-        # acquisizione AudioRange
-        scale = config_file.getElementsByTagName('Scale')
-        if scale.length < 1:
-            # se non c'è
-            print('Nessun fattore di scala trovato nel file di configurazione!')
-            exit(1)
-        else:
-            # se ci sono fattori
-            try:
-                self.scale_val = float(scale[0].attributes['value'].value)
-            except KeyError as ke:
-                print('Attributo "' + str(ke).split("'")[1] + '" di un tag Scale mancante')
-                exit(1)
-            except ValueError as ve:
-                print('Valore "' + str(ve).split("'")[1] + '"tag Scale non convertibile in float')
-                exit(1)
-        # acquisizione subvalue dal file di configurazione
-        sub = config_file.getElementsByTagName('SubValue')
-        if sub.length < 1:
-            # se non c'è il tag
-            print('Nessun SubValue trovato nel file di configurazione!')
-            exit(1)
-        else:
-            # se ci sono fattori
-            try:
-                self.sub_val = float(sub[0].attributes['value'].value)
-            except KeyError as ke:
-                print('Attributo "' + str(ke).split("'")[1] + '" di un tag SubValue mancante')
-                exit(1)
-            except ValueError as ve:
-                print('Valore "' + str(ve).split("'")[1] + '"tag SubValue non conv. in float')
-                exit(1)
-
-        # acquisizione range colori dal file di configurazione
-        self.colors_range = {
-            'Red': (0, 0),
-            'Green': (0, 0),
-            'Blue': (0, 0)
-        }
-        # per ogni colore
-        for col in self.colors_range:
-            c_tag = config_file.getElementsByTagName(col)
-            if c_tag.length < 1:
-                # se non c'è il tag per quel colore
-                print('Nessun tag {col} trovato nel file di configurazione!')
-                exit(1)
-            else:
-                # se ci sono fattori
-                try:
-                    # creazone tuple inizio fine del range di indici dell fft per colore
-                    tup = (
-                        int(c_tag[0].attributes['start'].value),
-                        int(c_tag[0].attributes['finish'].value)
-                    )
-                    self.colors_range[col] = tup
-                except KeyError as ke:
-                    print('Attributo "' + str(ke).split("'")[1] + '" di un tag {col} mancante')
-                    exit(1)
-                except ValueError as ve:
-                    print('Valore "' + str(ve).split("'")[1] + '"tag {col} non conv. in float')
-                    exit(1)
-
-        # definizione socket con ipv4 e metodo udp
-        self.socket = socket(AF_INET, SOCK_DGRAM)
-        try:
-            # connessione al gateway
-            self.socket.connect((self.address, self.port))
-        except ConnectionRefusedError:
-            print('Connessione al Gateway fallita.')
-            exit(1)
-
-        # set parametri gestione messaggi edmx
-        # stringa che spegne tutte le luci
-        self.alloff = 'EDMX' + '{:03d}'.format(self.first_chan) + '{:03d}'.format(len(self.lights) * 3)
-        self.alloff += ('000000' * len(self.lights))
-        # varibile contenente l'ultima stringa inviata. Inizializzata a 0
-        self.lastcolor = self.alloff
-        # variabile che identifica il numero corrispondente all'ordine dei 3 colori rgb
-        # esso verrà cambiato ogni tempo t da un timer ancora da implementare
-        self.rgb_order = 0
+        # configurazione e controllo delle sue modifiche durante l'esecuzione
+        self.config = config
+        self.watcher = ConfigWatcher(config)
+        # misure dei tempi di codifica e invio, frame scartati ed errori di invio
+        self.stats = Telemetry('sender', **asdict(config.telemetry))
+        # calcolo dei frame di tutti i gateway
+        self.builder = builder if builder is not None else FrameBuilder(config, self.stats)
+        # lista dei gateway (uno per universo dmx), ognuno con le proprie luci
+        self.gateways = []
+        for (gw, encoder) in zip(config.gateways, self.builder.encoders):
+            gateway = {
+                'name': gw.name,  # nome del gateway
+                # politica di invio dei frame
+                'policy': OutputPolicy(gw.maxfps, gw.keepalive, gw.threshold),
+                # definizione socket con ipv4 e metodo udp, uno per gateway
+                'socket': socket(AF_INET, SOCK_DGRAM),
+                # codificatore dei frame con i valori minimi e massimi di ogni lampada del gateway
+                'encoder': encoder
+            }
+            self.gateways.append(gateway)
+            # connessione al gateway, l'invio non deve bloccare gli altri gateway.
+            # In sACN l'indirizzo "multicast" indica il gruppo standard dell'universo
+            address = multicast_address(gw.universe) if gw.protocol == 'sacn' and gw.address == 'multicast' else gw.address
+            gateway['socket'].connect((address, gw.port))
+            gateway['socket'].setblocking(False)
+        # uscita a frequenza fissa, None se i frame seguono i chunk
+        self.refresh = None
+        if config.refresh.rate > 0:
+            self.refresh = RefreshStage(
+                sum(len(gw.lights) for gw in config.gateways),
+                config.refresh.rate, config.refresh.attack, config.refresh.release
+            )
+
+    # applica la configurazione se è stata modificata: nuovi fattori di AudioRange,
+    # nuova luce minima e massima ed effetti delle lampade, senza riaprire i socket
+    def __reload(self):
+        config = self.watcher.poll(time.monotonic())
+        if config is not None:
+            self.builder.reload(config)
+            self.config = config
+            self.stats.count('reloads')
+            print('Configurazione ricaricata')
 
-    # crea le tuple rgb in base all'ordine indicato dalla variabile rgb_order
-    def rgb_tuple_creator(self, a, b, c):
-        # print(self.rgb_order)
-        if self.rgb_order == 0:
-            return (a, b, c)
-        elif self.rgb_order == 1:
-            return (b, a, c)
-        elif self.rgb_order == 2:
-            return (c, b, a)
-
-    # funzione per arrestare la connessione socket e fermare il processo
+    # funzione per arrestare le connessioni socket e fermare il processo
     def stop(self):
+        for gateway in self.gateways:
+            gateway['socket'].close()
         exit(1)
-        self.socket.shutdown()
-        self.socket.close()
-
-    # funzione che attenua i valori rgb della luce alla posizione data in base ai
-    # valori impostati nel file di configurazione.
-    def rgb_normalization(self, light_pos, color):
-        (r, g, b) = color
-        if r < self.lights[light_pos]['min']:
-            r = self.lights[light_pos]['min']
-        if g < self.lights[light_pos]['min']:
-            g = self.lights[light_pos]['min']
-        if b < self.lights[light_pos]['min']:
-            b = self.lights[light_pos]['min']
-
-        if r > self.lights[light_pos]['max']:
-            r = self.lights[light_pos]['max']
-        if g > self.lights[light_pos]['max']:
-            g = self.lights[light_pos]['max']
-        if b > self.lights[light_pos]['max']:
-            b = self.lights[light_pos]['max']
-
-        ret = (r, g, b)
-        return ret
-
-    # crea la stringa da inviare dalle tuple di 3 valori rgb passate
-    def __EDMXBuilder(self, *ch_colors):
-        # prima parte della stringa: EDMX + canale di partenza + numero di canali da scrivere
-        string = 'EDMX' + '{:03d}'.format(self.first_chan) + '{:03d}'.format(len(ch_colors) * 3)
-        # per ogni tuple rgb passata
-        for c in ch_colors:
-            # append alla stringa del corrispondente esadecimale del valore rgb normalizzato
-            string += str(rgb_to_hex(self.rgb_normalization(ch_colors.index(c), c))).replace('#', '')
-        '''togliere commento per utilizzare la funzionalià descritta
-        # se la stringa che è stata formata è uguale all'ultima inviata
-        if string == self.lastcolor:
-            self.lastcolor = self.alloff
-            return self.alloff
-        else:
-            self.lastcolor = string
-        '''
-        return string
-
-    # converte la fft in una lista di tuple rgb
-    def __fft_converter(self, fft):
-        # determinazione valori di intensità per ogni colore in base alla fft
-        # proporzionata con i valori inseriti nel file di configurazione subval e scale
-        # creazipone argomenti da passare alla funzione per creare la stringa edmx
-        r = int(np.mean(fft[self.colors_range['Red'][0]:self.colors_range['Red'][1]]) * self.scale_val - self.sub_val)
-        g = int(np.mean(fft[self.colors_range['Green'][0]:self.colors_range['Green'][1]]) * self.scale_val - self.sub_val)
-        b = int(np.mean(fft[self.colors_range['Blue'][0]:self.colors_range['Blue'][1]]) * self.scale_val - self.sub_val)
-
-        args = (self.rgb_tuple_creator(r, g, b) for i in range(len(self.lights)))
-
-        return self.__EDMXBuilder(*args)
-
-    # invia la stringa tramite socket dopo averla codificata
-    def __send(self, message):
-        self.socket.sendall(message.encode())
+
+    # invia i frame ai rispettivi gateway uno dopo l'altro, già tutti codificati,
+    # in modo che l'ultimo universo non resti indietro rispetto al primo.
+    # Se force è False ogni frame passa dalla politica di invio del suo gateway
+    def __send(self, frames, force=False):
+        now = time.monotonic()
+        for (gateway, frame) in zip(self.gateways, frames):
+            if force or gateway['policy'].offer(gateway['encoder'].values, now):
+                self.__send_frame(gateway, frame, now)
+            else:
+                self.stats.count('frames_skipped')
+
+    # invia un frame al gateway e lo registra nella sua politica di invio
+    def __send_frame(self, gateway, frame, now):
+        start = time.perf_counter()
+        try:
+            gateway['socket'].send(frame)
+        except OSError:
+            # buffer del socket pieno, gateway o rete non raggiungibili: il frame viene perso e
+            # il sender continua, altrimenti il suo cursore fermerebbe anche reader e player
+            self.stats.count('send_errors')
+            return
+        self.stats.observe('send', time.perf_counter() - start)
+        self.stats.count('frames_sent')
+        gateway['policy'].sent(gateway['encoder'].values, now)
+
+    # invia i frame accorpati il cui intervallo minimo è scaduto
+    def __flush(self):
+        now = time.monotonic()
+        for gateway in self.gateways:
+            if gateway['policy'].wait_time(now) == 0:
+                self.__send_frame(gateway, gateway['encoder'].frame, now)
+
+    # secondi da attendere prima di dover inviare un frame accorpato, None se non ce ne sono
+    def __pending_wait(self):
+        now = time.monotonic()
+        waits = [gateway['policy'].wait_time(now) for gateway in self.gateways]
+        waits = [w for w in waits if w is not None]
+        return min(waits) if len(waits) > 0 else None
+
+    # invio a frequenza fissa: le celle del buffer vengono lette appena rilasciate dal player e i loro
+    # colori aggiunti come fotogrammi chiave, ad ogni scadenza del timer viene inviato il frame
+    # interpolato per l'istante in cui sarà visibile. A fine playlist i fotogrammi rimasti vengono
+    # inviati fino all'ultimo prima dello spegnimento
+    def __run_fixed(self):
+        next_tick = time.monotonic()
+        ending = False
+        while True:
+            # applicazione delle modifiche alla configurazione
+            self.__reload()
+            msg = None
+            if not ending:
+                # attesa di una nuova cella fino alla prossima scadenza del timer
+                msg = self.sound_data.get('sender', timeout=max(0.0, next_tick - time.monotonic()))
+            elif next_tick > time.monotonic():
+                time.sleep(next_tick - time.monotonic())
+            if msg is not None:
+                if msg.kind == EOSONG:
+                    print('invio canzone finito')
+                elif msg.kind == EOPLAYLIST:
+                    print('Invio playlist finito')
+                    ending = True
+                else:
+                    start = time.perf_counter()
+                    colors = self.builder.render(msg.features)
+                    if colors is not None:
+                        self.refresh.push(msg.stamp, colors)
+                    self.stats.observe('encode', time.perf_counter() - start)
+                self.sound_data.advance('sender')
+            now = time.monotonic()
+            if now < next_tick:
+                continue
+            # frame dell'istante in cui sarà visibile, anticipato della latenza di gateway e lampade
+            visible = now + self.config.sync_offset
+            if ending and (self.refresh.last() is None or visible >= self.refresh.last()):
+                # spegnimento di tutte le luci connesse, un frame per gateway
+                self.__send([gateway['encoder'].off() for gateway in self.gateways], force=True)
+                return
+            values = self.refresh.sample(visible)
+            if values is not None:
+                self.__send(self.builder.encode(values))
+            self.stats.count('ticks')
+            next_tick += self.refresh.period
+            if next_tick < now:
+                # timer in ritardo di più di un periodo: si riparte da ora invece di recuperare
+                self.stats.count('late_ticks')
+                next_tick = now + self.refresh.period
+            self.stats.tick()
 
     # funzione innescata quando viene chiamato start() sull'istanza nel main
     def run(self):
+        if self.refresh is not None:
+            return self.__run_fixed()
         while True:
-            self.events['can_send'].wait()  # attesa che questo processo venga autorizzato dal reader
-            self.events['can_send'].clear()  # revoca del permesso del permesso di essere eseguito alla sucessiva iteazione
-            msg = self.sound_data.pop(0)  # pop() del messaggio da invaire dal buffer dei dati musicali
-            self.events['can_read'].set()  # wakeup del processo di lettura, se non è in esecuzione e non ha finito di leggere
-            if str(msg) == 'EOSong':  # se la canzone è terminata
-                if str(self.sound_data[0]) == 'EOPlaylist':  # se tutte le canzoni sono terminate
-                    print('Invio playlist finito')
-                    self.__send(self.alloff)  # spegnimento di tutte le luci connesse
-                    exit(0)  # terminazione del thread
+            # applicazione delle modifiche alla configurazione
+            self.__reload()
+            # attesa che il player rilasci il prossimo chunk o che scada l'invio di un frame accorpato
+            msg = self.sound_data.get('sender', timeout=self.__pending_wait())
+            if msg is None:
+                self.__flush()
+                self.stats.tick()
+                continue
+            elif msg.kind == EOSONG:  # se la canzone è terminata
                 print('invio canzone finito')
-            # se si deve inviare il pachetto: il dato letto è di tipo Chunk
+            elif msg.kind == EOPLAYLIST:  # se tutte le canzoni sono terminate
+                print('Invio playlist finito')
+                # spegnimento di tutte le luci connesse, un frame per gateway
+                self.__send([gateway['encoder'].off() for gateway in self.gateways], force=True)
+                self.sound_data.advance('sender')
+                return  # terminazione del processo (o del thread)
+            # se si deve inviare il pachetto: il dato letto è un chunk
             else:
-                self.__send(self.__fft_converter(msg.fft))
+                start = time.perf_counter()
+                frames = self.builder.build(msg.features)
+                self.stats.observe('encode', time.perf_counter() - start)
+                if frames is not None:
+                    # attesa dell'istante in cui il chunk sarà udibile, anticipato della latenza di gateway e lampade
+                    delay = msg.stamp - self.config.sync_offset - time.monotonic()
+                    if msg.stamp > 0 and delay > 0:
+                        time.sleep(delay)
+                    elif msg.stamp > 0:
+                        # il chunk è già udibile: frame in ritardo
+                        self.stats.count('late')
+                        self.stats.observe('lateness', -delay)
+                    self.__send(frames)
+                self.stats.tick()
+            self.sound_data.advance('sender')  # rilascio della cella, wakeup del processo di lettura se il buffer era pieno